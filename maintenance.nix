@@ -9,6 +9,8 @@ let
     click
     cxxfilt
     defusedxml
+    ijson
+    orjson
     packageurl-python
     psycopg2
     pytest
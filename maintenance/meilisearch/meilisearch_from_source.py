@@ -284,6 +284,12 @@ def main(config_file, source_directory, identifiers):
         except:
             pass
 
+    # the identifiers are looked up for every ctags result,
+    # so store them as frozensets instead of lists
+    for exec_type in lq_identifiers:
+        for identifier_type in lq_identifiers[exec_type]:
+            lq_identifiers[exec_type][identifier_type] = frozenset(lq_identifiers[exec_type][identifier_type])
+
     # read the configuration file. This is in YAML format
     try:
         config = load(config_file, Loader=Loader)
@@ -16,13 +16,19 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import json
 import pathlib
 import sys
 
 import click
 import tlsh
 
+# use orjson for parsing JSON if available, as it is a lot
+# faster than the JSON module from the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 import proximity_matcher_webservice.vpt as vpt
 
 @click.command(short_help='process TLSH hashes and turn into a pickle')
@@ -41,8 +47,8 @@ def main(json_directory, outfile, optimize, tlsh_filter):
     tlsh_objects = []
     for result_file in json_directory.glob('**/*'):
         try:
-            with open(result_file, 'r') as json_archive:
-                json_results = json.load(json_archive)
+            with open(result_file, 'rb') as json_archive:
+                json_results = json_loads(json_archive.read())
 
             # first a sanity check to see if the SHA256 is the same as
             # the stem of the file name
@@ -58,6 +58,11 @@ def main(config_file, result_directory, identifiers, force):
         except:
             pass
 
+    # lookups in a frozenset are much cheaper than in a list
+    for exec_type in lq_identifiers:
+        for identifier_type in lq_identifiers[exec_type]:
+            lq_identifiers[exec_type][identifier_type] = frozenset(lq_identifiers[exec_type][identifier_type])
+
     # read the configuration file. This is in YAML format
     try:
         configuration = load(config_file, Loader=Loader)
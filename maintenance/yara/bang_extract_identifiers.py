@@ -10,12 +10,11 @@
 Process source code archives, extracts identifiers and output as JSON
 '''
 
+import functools
 import hashlib
 import json
 import multiprocessing
 import pathlib
-import queue
-import re
 import shutil
 import subprocess
 import sys
@@ -34,6 +33,13 @@ try:
 except ImportError:
     from yaml import Loader
 
+# use orjson for parsing the ctags output if available,
+# as it is a lot faster than the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 from yara_config import YaraConfig, YaraConfigException
 
 # lists of extenions for several programming language families
@@ -48,11 +54,6 @@ SRC_EXTENSIONS = C_SRC_EXTENSIONS + JAVA_SRC_EXTENSIONS
 
 TAR_SUFFIX = ['.tbz2', '.tgz', '.txz', '.tlz', '.tz', '.gz', '.bz2', '.xz', '.lzma']
 
-REMOVE_CHARACTERS = ['\a', '\b', '\v', '\f', '\x01', '\x02', '\x03', '\x04',
-                     '\x05', '\x06', '\x0e', '\x0f', '\x10', '\x11', '\x12',
-                     '\x13', '\x14', '\x15', '\x16', '\x17', '\x18', '\x19',
-                     '\x1a', '\x1b', '\x1c', '\x1d', '\x1e', '\x1f', '\x7f']
-
 REMOVE_CHARACTERS_TABLE = str.maketrans({'\a': '', '\b': '', '\v': '',
                                          '\f': '', '\x01': '', '\x02': '',
                                          '\x03': '', '\x04': '', '\x05': '',
@@ -66,181 +67,175 @@ REMOVE_CHARACTERS_TABLE = str.maketrans({'\a': '', '\b': '', '\v': '',
                                         })
 
 
-def extract_identifiers(process_queue, temporary_directory, json_output_directory,
+def extract_identifiers(archive_info, temporary_directory, json_output_directory,
                         extraction_env, package_meta_information):
     '''Unpack a tar archive based on extension and extract identifiers'''
+    purl, version, archive = archive_info
 
-    while True:
-        try:
-            purl, version, archive = process_queue.get()
-        except queue.Empty:
-            break
-
-        try:
-            tarchive = tarfile.open(name=archive)
-            members = tarchive.getmembers()
-        except Exception as e:
-            process_queue.task_done()
-            continue
-
-        identifiers_per_language = {}
+    try:
+        tarchive = tarfile.open(name=archive)
+        members = tarchive.getmembers()
+    except Exception as e:
+        return
 
-        for l in ['c', 'java']:
-            identifiers_per_language[l] = {}
-            identifiers_per_language[l]['strings'] = set()
-            identifiers_per_language[l]['functions'] = set()
-            identifiers_per_language[l]['variables'] = set()
+    identifiers_per_language = {}
 
-        extracted = 0
+    for l in ['c', 'java']:
+        identifiers_per_language[l] = {}
+        identifiers_per_language[l]['strings'] = set()
+        identifiers_per_language[l]['functions'] = set()
+        identifiers_per_language[l]['variables'] = set()
 
-        for m in members:
-            extract_file = pathlib.Path(m.name)
-            if extract_file.suffix.lower() in SRC_EXTENSIONS:
-                extracted += 1
-                break
+    extracted = 0
 
-        if extracted == 0:
-            process_queue.task_done()
-            continue
+    for m in members:
+        extract_file = pathlib.Path(m.name)
+        if extract_file.suffix.lower() in SRC_EXTENSIONS:
+            extracted += 1
+            break
 
-        with open(archive, 'rb') as package_data:
-            archive_hash = hashlib.new('sha256')
-            archive_hash.update(package_data.read())
-            package_hash = archive_hash.hexdigest()
-
-        unpack_dir = tempfile.TemporaryDirectory(dir=temporary_directory)
-        tarchive.extractall(path=unpack_dir.name)
-        for m in members:
-            extract_file = pathlib.Path(m.name)
-            if extract_file.suffix.lower() in SRC_EXTENSIONS:
-                if extract_file.suffix.lower() in C_SRC_EXTENSIONS:
-                    language = 'c'
-                elif extract_file.suffix.lower() in JAVA_SRC_EXTENSIONS:
-                    language = 'java'
-
-                # some path sanity checks (TODO: add more checks)
-                if extract_file.is_absolute():
-                    pass
-                else:
-                    member = open(unpack_dir.name / extract_file, 'rb')
-                    member_data = member.read()
-                    member.close()
-                    member_hash = hashlib.new('sha256')
-                    member_hash.update(member_data)
-                    file_hash = member_hash.hexdigest()
-
-                    # TODO: lookup hash in some database to detect third
-                    # party/external components so they can be ignored
-
-                    # first run xgettext
-                    p = subprocess.Popen(['xgettext', '-a', '-o', '-', '--no-wrap', '--no-location', '--omit-header', '-'],
-                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
-                    (stdout, stderr) = p.communicate(member_data)
-
-                    if p.returncode == 0 and stdout != b'':
-                        # process the output of standard out
-                        lines = stdout.splitlines()
-                        for line in lines:
-                            if line.strip() == b'':
-                                continue
-                            if line.startswith(b'#'):
-                                # skip comments, hints, etc.
-                                continue
-                            if line.startswith(b'msgstr'):
-                                continue
+    if extracted == 0:
+        return
+
+    with open(archive, 'rb') as package_data:
+        archive_hash = hashlib.new('sha256')
+        archive_hash.update(package_data.read())
+        package_hash = archive_hash.hexdigest()
+
+    unpack_dir = tempfile.TemporaryDirectory(dir=temporary_directory)
+    tarchive.extractall(path=unpack_dir.name)
+    for m in members:
+        extract_file = pathlib.Path(m.name)
+        if extract_file.suffix.lower() in SRC_EXTENSIONS:
+            if extract_file.suffix.lower() in C_SRC_EXTENSIONS:
+                language = 'c'
+            elif extract_file.suffix.lower() in JAVA_SRC_EXTENSIONS:
+                language = 'java'
+
+            # some path sanity checks (TODO: add more checks)
+            if extract_file.is_absolute():
+                pass
+            else:
+                member = open(unpack_dir.name / extract_file, 'rb')
+                member_data = member.read()
+                member.close()
+                member_hash = hashlib.new('sha256')
+                member_hash.update(member_data)
+                file_hash = member_hash.hexdigest()
+
+                # TODO: lookup hash in some database to detect third
+                # party/external components so they can be ignored
+
+                # first run xgettext
+                p = subprocess.Popen(['xgettext', '-a', '-o', '-', '--no-wrap', '--no-location', '--omit-header', '-'],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+                (stdout, stderr) = p.communicate(member_data)
+
+                if p.returncode == 0 and stdout != b'':
+                    # process the output of standard out
+                    lines = stdout.splitlines()
+                    for line in lines:
+                        if line.strip() == b'':
+                            continue
+                        if line.startswith(b'#'):
+                            # skip comments, hints, etc.
+                            continue
+                        if line.startswith(b'msgstr'):
+                            continue
+                        try:
+                            decoded_line = line.decode()
+
+                            if decoded_line.startswith('msgid '):
+                                msg_id = decoded_line[7:-1]
+                            else:
+                                msg_id = decoded_line[1:-1]
+
+                            # this is a bit of a horrible hack
+                            # https://stackoverflow.com/questions/1885181/how-to-un-escape-a-backslash-escaped-string
                             try:
-                                decoded_line = line.decode()
-
-                                if decoded_line.startswith('msgid '):
-                                    msg_id = decoded_line[7:-1]
-                                else:
-                                    msg_id = decoded_line[1:-1]
-
-                                # this is a bit of a horrible hack
-                                # https://stackoverflow.com/questions/1885181/how-to-un-escape-a-backslash-escaped-string
-                                try:
-                                    msg_id = msg_id.encode('utf-8', 'backslashreplace').decode('unicode-escape')
-                                except:
-                                    continue
+                                msg_id = msg_id.encode('utf-8', 'backslashreplace').decode('unicode-escape')
+                            except:
+                                continue
 
-                                # backslashes should be replaced now so
-                                # split on newlines
-                                msg_ids = msg_id.splitlines()
-                                for m in msg_ids:
-                                    for rc in REMOVE_CHARACTERS:
-                                        if rc in m:
-                                            m = m.translate(REMOVE_CHARACTERS_TABLE)
+                            # backslashes should be replaced now so
+                            # split on newlines
+                            msg_ids = msg_id.splitlines()
+                            for m in msg_ids:
+                                # all the characters to be removed are not
+                                # printable, so most strings can be skipped.
+                                if not m.isprintable():
+                                    m = m.translate(REMOVE_CHARACTERS_TABLE)
 
-                                    if m == '':
-                                        continue
+                                if m == '':
+                                    continue
 
-                                    # ignore whitespace-only strings
-                                    if re.match(r'^\s+$', m) is not None:
-                                        continue
+                                # ignore whitespace-only strings
+                                if m.isspace():
+                                    continue
 
-                                    identifiers_per_language[language]['strings'].add(m)
-                            except:
-                                pass
-
-                    # then run ctags. Unfortunately ctags cannot process
-                    # information from stdin so the file has to be extracted first
-                    p = subprocess.Popen(['ctags', '--output-format=json', '-f', '-', unpack_dir.name / extract_file ],
-                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
-                    (stdout, stderr) = p.communicate()
-                    if p.returncode == 0 and stdout != b'':
-                        lines = stdout.splitlines()
-                        for line in lines:
-                            try:
-                                ctags_json = json.loads(line)
-                            except json.decoder.JSONDecodeError:
-                                continue
-                            try:
-                                ctags_name = ctags_json['name']
-                                if ctags_json['kind'] == 'field':
-                                    identifiers_per_language[language]['variables'].add(ctags_name)
-                                elif ctags_json['kind'] == 'variable':
-                                    # Kotlin uses variables, not fields
-                                    identifiers_per_language[language]['variables'].add(ctags_name)
-                                elif ctags_json['kind'] == 'method':
-                                    identifiers_per_language[language]['functions'].add(ctags_name)
-                                elif ctags_json['kind'] == 'function':
-                                    identifiers_per_language[language]['functions'].add(ctags_name)
-                            except:
-                                pass
-
-        for language in identifiers_per_language:
-            metadata= {}
-            metadata['archive'] = archive.name
-            metadata['sha256'] = package_hash
-            metadata['package'] = package_meta_information['package']
-            metadata['language'] = language
-            metadata['version'] = purl.version
-            metadata['packageurl'] = purl.to_string()
-            website = package_meta_information.get('website')
-            if website is not None:
-                metadata['website'] = website
-            cpe = package_meta_information.get('cpe')
-            if cpe is not None:
-                metadata['cpe'] = cpe
-            cpe23 = package_meta_information.get('cpe23')
-            if cpe23 is not None:
-                metadata['cpe23'] = cpe23
-
-            strings = sorted(identifiers_per_language[language]['strings'])
-            variables = sorted(identifiers_per_language[language]['variables'])
-            functions = sorted(identifiers_per_language[language]['functions'])
-
-            if not (strings == [] and variables == [] and functions == []):
-                # write results to a JSON file for later processing
-                json_file = json_output_directory / (f"{archive.name}-{language}.json")
-                with open(json_file, 'w') as dump_file:
-                    json.dump({'metadata': metadata, 'strings': strings,
-                              'variables': variables, 'functions': functions}, dump_file, indent=4)
-
-        unpack_dir.cleanup()
-        process_queue.task_done()
+                                identifiers_per_language[language]['strings'].add(m)
+                        except:
+                            pass
+
+                # then run ctags. Unfortunately ctags cannot process
+                # information from stdin so the file has to be extracted first
+                p = subprocess.Popen(['ctags', '--output-format=json', '-f', '-', unpack_dir.name / extract_file ],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+                (stdout, stderr) = p.communicate()
+                if p.returncode == 0 and stdout != b'':
+                    lines = stdout.splitlines()
+                    for line in lines:
+                        try:
+                            ctags_json = json_loads(line)
+                        except json.decoder.JSONDecodeError:
+                            continue
+                        try:
+                            ctags_name = ctags_json['name']
+                            if ctags_json['kind'] == 'field':
+                                identifiers_per_language[language]['variables'].add(ctags_name)
+                            elif ctags_json['kind'] == 'variable':
+                                # Kotlin uses variables, not fields
+                                identifiers_per_language[language]['variables'].add(ctags_name)
+                            elif ctags_json['kind'] == 'method':
+                                identifiers_per_language[language]['functions'].add(ctags_name)
+                            elif ctags_json['kind'] == 'function':
+                                identifiers_per_language[language]['functions'].add(ctags_name)
+                        except:
+                            pass
+
+    for language in identifiers_per_language:
+        metadata= {}
+        metadata['archive'] = archive.name
+        metadata['sha256'] = package_hash
+        metadata['package'] = package_meta_information['package']
+        metadata['language'] = language
+        metadata['version'] = purl.version
+        metadata['packageurl'] = purl.to_string()
+        website = package_meta_information.get('website')
+        if website is not None:
+            metadata['website'] = website
+        cpe = package_meta_information.get('cpe')
+        if cpe is not None:
+            metadata['cpe'] = cpe
+        cpe23 = package_meta_information.get('cpe23')
+        if cpe23 is not None:
+            metadata['cpe23'] = cpe23
+
+        strings = sorted(identifiers_per_language[language]['strings'])
+        variables = sorted(identifiers_per_language[language]['variables'])
+        functions = sorted(identifiers_per_language[language]['functions'])
+
+        if not (strings == [] and variables == [] and functions == []):
+            # write results to a JSON file for later processing
+            json_file = json_output_directory / (f"{archive.name}-{language}.json")
+            # json.dump() writes many small chunks, so use a large buffer
+            with open(json_file, 'w', buffering=1024*1024) as dump_file:
+                json.dump({'metadata': metadata, 'strings': strings,
+                          'variables': variables, 'functions': functions}, dump_file, indent=4)
+
+    unpack_dir.cleanup()
 
 
 @click.command(short_help='process source code files and output JSON')
@@ -316,11 +311,8 @@ def main(config_file, source_directory, meta):
 
     json_output_directory.mkdir(exist_ok=True)
 
-    processmanager = multiprocessing.Manager()
-
-    # create a queue for scanning files
-    process_queue = processmanager.JoinableQueue(maxsize=0)
-    processes = []
+    # the archives that should be scanned
+    archives = []
 
     # walk the archives directory, only support tar files now
     for archive in packages:
@@ -351,24 +343,20 @@ def main(config_file, source_directory, meta):
         tar_archive = source_directory / archive_name
         if not tarfile.is_tarfile(tar_archive):
             continue
-        process_queue.put((purl, version, tar_archive))
-
-    # create processes for unpacking archives
-    for i in range(0, extraction_env['threads']):
-        process = multiprocessing.Process(target=extract_identifiers,
-                                          args=(process_queue, extraction_env['temporary_directory'],
-                                                json_output_directory, extraction_env, package_meta_information))
-        processes.append(process)
-
-    # start all the processes
-    for process in processes:
-        process.start()
-
-    process_queue.join()
-
-    # Done processing, terminate processes
-    for process in processes:
-        process.terminate()
+        archives.append((purl, version, tar_archive))
+
+    # unpack the archives and extract identifiers in parallel. A pool
+    # is used instead of a queue from a manager process, so that the
+    # archives do not have to be sent through an extra process.
+    process_archive = functools.partial(extract_identifiers,
+                                        temporary_directory=extraction_env['temporary_directory'],
+                                        json_output_directory=json_output_directory,
+                                        extraction_env=extraction_env,
+                                        package_meta_information=package_meta_information)
+
+    with multiprocessing.Pool(extraction_env['threads']) as pool:
+        for _ in pool.imap_unordered(process_archive, archives):
+            pass
 
 
 if __name__ == "__main__":
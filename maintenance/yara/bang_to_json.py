@@ -17,8 +17,6 @@ import json
 import multiprocessing
 import pathlib
 import pickle
-import queue
-import re
 import sys
 
 import click
@@ -28,9 +26,11 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
     '''Generate a JSON output file for a single ELF or Dex binary'''
 
     while True:
-        try:
-            bang_pickle = scan_queue.get()
-        except queue.Empty:
+        bang_pickle = scan_queue.get()
+
+        # None is used to signal that there is no more work
+        if bang_pickle is None:
+            scan_queue.task_done()
             break
 
         # open the pickle
@@ -91,7 +91,7 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
             if 'strings' in bang_data['metadata']:
                 for s in bang_data['metadata']['strings']:
                     # ignore whitespace-only strings
-                    if re.match(r'^\s+$', s) is None:
+                    if not s.isspace():
                         strings.append(s)
 
             # process symbols
@@ -118,7 +118,7 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
                 fields = []
                 for method in c['methods']:
                     # ignore whitespace-only methods
-                    if re.match(r'^\s+$', method['name']) is not None:
+                    if method['name'].isspace():
                         continue
                     if method['name'] in ['<init>', '<clinit>']:
                         continue
@@ -130,7 +130,7 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
 
                 for field in c['fields']:
                     # ignore whitespace-only fields
-                    if re.match(r'^\s+$', field['name']) is not None:
+                    if field['name'].isspace():
                         continue
 
                 if methods != [] or fields != []:
@@ -151,7 +151,7 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
             if 'strings' in bang_data['metadata']:
                 for s in bang_data['metadata']['strings']:
                     # ignore whitespace-only strings
-                    if re.match(r'^\s+$', s) is None:
+                    if not s.isspace():
                         strings.append(s)
 
             # process data for each method found in the Java class file
@@ -163,7 +163,7 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
 
             for field in bang_data['metadata']['fields']:
                 # ignore whitespace-only fields
-                if re.match(r'^\s+$', field) is not None:
+                if field.isspace():
                     continue
                 if field in ['this$0']:
                     continue
@@ -171,9 +171,9 @@ def process_bang(scan_queue, output_directory, process_lock, processed_files, ta
         meta_info['labels'] += bang_data['labels']
         meta_info['metadata'] = metadata
 
-        # dump JSON
+        # dump JSON. json.dump() writes many small chunks, so use a large buffer
         json_file = output_directory / (f"{metadata['name']}-{metadata['sha256']}.json")
-        with open(json_file, 'w') as json_dump:
+        with open(json_file, 'w', buffering=1024*1024) as json_dump:
             json.dump(meta_info, json_dump, indent=4)
 
         scan_queue.task_done()
@@ -269,15 +269,19 @@ def main(result_directory, output_directory, jobs, tags):
                                                 output_directory, process_lock,
                                                 processed_files, list(tags))) for i in range(jobs)]
 
+    # tell each process to stop when the queue has been processed
+    for process in processes:
+        scan_queue.put(None)
+
     # start all the processes
     for process in processes:
         process.start()
 
     scan_queue.join()
 
-    # Done processing, terminate processes
+    # Done processing, wait for the processes to exit
     for process in processes:
-        process.terminate()
+        process.join()
 
 
 if __name__ == "__main__":
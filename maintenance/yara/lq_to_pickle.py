@@ -3,22 +3,23 @@
 '''
 This script reads two files with names of low quality functions and variable
 names (one per line) and turns them into a pickle which can be used by scripts
-to ignore low quality identifiers.
+to ignore low quality identifiers. The identifiers are stored as frozensets so
+scripts can use them for lookups without converting them first.
 '''
 
 import pickle
 
-lq_elf_funcs = list(map(lambda x: x.strip(), open('low_quality_elf_funcs', 'r').readlines()))
+lq_elf_funcs = frozenset(map(lambda x: x.strip(), open('low_quality_elf_funcs', 'r').readlines()))
 
-lq_elf_vars = list(map(lambda x: x.strip(), open('low_quality_elf_vars', 'r').readlines()))
+lq_elf_vars = frozenset(map(lambda x: x.strip(), open('low_quality_elf_vars', 'r').readlines()))
 
-lq_elf_strings = list(map(lambda x: x.strip(), open('low_quality_elf_strings', 'r').readlines()))
+lq_elf_strings = frozenset(map(lambda x: x.strip(), open('low_quality_elf_strings', 'r').readlines()))
 
-lq_dex_funcs = []
+lq_dex_funcs = frozenset()
 
-lq_dex_vars = []
+lq_dex_vars = frozenset()
 
-lq_dex_strings = []
+lq_dex_strings = frozenset()
 
 lq_pickle = open('low_quality_identifiers.pickle', 'wb')
 
@@ -13,12 +13,12 @@ and strings that were extracted from a binary using BANG.
 Use bang_to_json.py to generate the JSON file.
 '''
 
-import copy
 import datetime
-import json
+import functools
+import multiprocessing
+import os
 import pathlib
 import pickle
-import re
 import sys
 import uuid
 
@@ -33,26 +33,90 @@ try:
 except ImportError:
     from yaml import Loader
 
+# use orjson for parsing JSON if available, as it is a lot
+# faster than the JSON module from the standard library
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# use ijson (if available) to stream very large JSON files
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# errors caused by JSON files that are not valid BANG results
+if ijson is not None:
+    INVALID_BANG_JSON_ERRORS = (KeyError, TypeError, ijson.JSONError)
+else:
+    INVALID_BANG_JSON_ERRORS = (KeyError, TypeError)
+
 from yara_config import YaraConfig, YaraConfigException
 
 # ignore object files (regular and GHC specific)
 IGNORED_ELF_SUFFIXES = ['.o', '.p_o']
 
-# YARA escape sequences
-ESCAPE = str.maketrans({'"': '\\"',
-                        '\\': '\\\\',
-                        '\t': '\\t',
-                        '\n': '\\n'})
+# ignore constructors in Dex files
+IGNORED_DEX_METHODS = frozenset(['<init>', '<clinit>'])
+
+# JSON files larger than this are streamed with ijson instead of
+# being read into memory at once, if ijson is available.
+STREAM_JSON_SIZE = 100 * 1024 * 1024
 
 NAME_ESCAPE = str.maketrans({'.': '_',
                              '-': '_'})
 
+# characters that have a special meaning in a package url
+# and which could be part of a version string
+PURL_SPECIAL_CHARACTERS = frozenset('@?#%/')
+
+# configuration (including the low quality identifiers) for
+# worker processes, set once per process by init_worker()
+worker_yara_env = None
+
+
+def init_worker(yara_env):
+    '''Store the configuration in a worker process. This is done once
+       per worker, instead of sending it along with every task.'''
+    global worker_yara_env
+    worker_yara_env = yara_env
+
+def escape_yara(string):
+    '''Escape a string for use in a YARA rule. Chained str.replace() calls
+       are a lot faster than str.translate() with a table that maps a
+       character to multiple characters. The backslash is escaped first.
+       Most strings do not need escaping, so check that first.'''
+    if not ('\\' in string or '"' in string or '\t' in string or '\n' in string):
+        return string
+    return string.replace('\\', '\\\\').replace('"', '\\"').replace('\t', '\\t').replace('\n', '\\n')
+
+def condition_numbers(heuristics, num_strings, num_functions, num_variables):
+    '''Compute how many strings, functions and variables have to match in
+       a YARA rule. Returns 'any' for an identifier type if there are fewer
+       identifiers than the minimum that should be present.'''
+    numbers = []
+    for identifier_type, num_identifiers in [('strings', num_strings),
+                                             ('functions', num_functions),
+                                             ('variables', num_variables)]:
+        if num_identifiers >= heuristics[f'{identifier_type}_minimum_present']:
+            numbers.append(str(int(max(num_identifiers//heuristics[f'{identifier_type}_percentage'],
+                                       heuristics[f'{identifier_type}_matched']))))
+        else:
+            numbers.append('any')
+    return tuple(numbers)
 
 def generate_yara(yara_file, metadata, functions, variables, strings,
                   tags, num_strings, num_funcs, num_vars, fullword,
-                  yara_operator, bang_type):
-    '''Generate YARA rules from identifiers. Returns a UUID for a rule.'''
-    generate_date = datetime.datetime.utcnow().isoformat()
+                  yara_operator, bang_type, generate_date=None):
+    '''Generate YARA rules from identifiers. Returns a UUID for a rule,
+       or None if there are no identifiers and no rule was written.
+       The functions, variables and strings should already be sorted.'''
+    if not (strings or functions or variables):
+        return None
+
+    if generate_date is None:
+        generate_date = datetime.datetime.utcnow().isoformat()
     rule_uuid = uuid.uuid4()
     total_identifiers = len(functions) + len(variables) + len(strings)
     meta = f'''
@@ -63,10 +127,7 @@ def generate_yara(yara_file, metadata, functions, variables, strings,
         uuid = "{rule_uuid}"
         total_identifiers = "{total_identifiers}"
         identifiers_from = "{bang_type}"
-'''
-
-    for m in sorted(metadata):
-        meta += f'        {m} = "{metadata[m]}"\n'
+''' + ''.join(f'        {m} = "{metadata[m]}"\n' for m in sorted(metadata))
 
     # create a tags string for the rule if there are any tags.
     # These can be used by YARA to only run specific rules.
@@ -77,88 +138,133 @@ def generate_yara(yara_file, metadata, functions, variables, strings,
     rule = str(rule_uuid).translate(NAME_ESCAPE)
     rule_name = f'rule rule_{rule}{tags_string}\n'
 
-    with yara_file.open(mode='w') as p:
-        p.write(rule_name)
-        p.write('{')
-        p.write(meta)
-        p.write('\n    strings:\n')
-
-        # First write all strings
-        if strings != []:
-            p.write("\n        // Extracted strings\n\n")
-            counter = 1
-            for s in strings:
-                try:
-                    s_translated = s.translate(ESCAPE)
-                    p.write(f"        $string{counter} = \"{s_translated}\"{fullword}\n")
-                    counter += 1
-                except:
-                    pass
-
-        # Then write the functions
-        if functions != []:
-            p.write("\n        // Extracted functions\n\n")
-            counter = 1
-            for s in sorted(functions):
-                p.write(f"        $function{counter} = \"{s}\"{fullword}\n")
-                counter += 1
-
-        # Then the variable names
-        if variables != []:
-            p.write("\n        // Extracted variables\n\n")
-            counter = 1
-            for s in sorted(variables):
-                p.write(f"        $variable{counter} = \"{s}\"{fullword}\n")
-                counter += 1
-
-        # Finally write the conditions
-        p.write('\n    condition:\n')
-        if strings != []:
-            p.write(f'        {num_strings} of ($string*)')
-
-            if not (functions == [] and variables == []):
-                p.write(f' {yara_operator}\n')
-            else:
-                p.write('\n')
-        if functions != []:
-            p.write(f'        {num_funcs} of ($function*)')
+    # first collect all the parts of the rule and then
+    # write the rule to the file in one go
+    parts = [rule_name, '{', meta, '\n    strings:\n']
+
+    # First add all strings
+    if strings != []:
+        parts.append("\n        // Extracted strings\n\n")
+        parts.extend(f"        $string{counter} = \"{escape_yara(s)}\"{fullword}\n"
+                     for counter, s in enumerate(strings, 1))
+
+    # Then add the functions
+    if functions != []:
+        parts.append("\n        // Extracted functions\n\n")
+        parts.extend(f"        $function{counter} = \"{s}\"{fullword}\n"
+                     for counter, s in enumerate(functions, 1))
+
+    # Then the variable names
+    if variables != []:
+        parts.append("\n        // Extracted variables\n\n")
+        parts.extend(f"        $variable{counter} = \"{s}\"{fullword}\n"
+                     for counter, s in enumerate(variables, 1))
+
+    # Finally add the conditions
+    parts.append('\n    condition:\n')
+    if strings != []:
+        parts.append(f'        {num_strings} of ($string*)')
+
+        if not (functions == [] and variables == []):
+            parts.append(f' {yara_operator}\n')
+        else:
+            parts.append('\n')
+    if functions != []:
+        parts.append(f'        {num_funcs} of ($function*)')
 
-            if variables != []:
-                p.write(' %s\n' % yara_operator)
-            else:
-                p.write('\n')
         if variables != []:
-            p.write(f'        {num_vars} of ($variable*)')
-        p.write('\n}')
+            parts.append(f' {yara_operator}\n')
+        else:
+            parts.append('\n')
+    if variables != []:
+        parts.append(f'        {num_vars} of ($variable*)')
+    parts.append('\n}')
+
+    # write the rule with a plain file descriptor, as the rule is
+    # written in one go and does not need any buffering.
+    rule_data = memoryview(''.join(parts).encode())
+    yara_fd = os.open(yara_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while rule_data:
+            bytes_written = os.write(yara_fd, rule_data)
+            rule_data = rule_data[bytes_written:]
+    finally:
+        os.close(yara_fd)
 
     # return the UUID for the rule so it can be recorded
     return rule_uuid
 
-@click.group()
-def app():
-    pass
-
-@app.command(short_help='process a BANG JSON result file and output YARA rules for binaries')
-@click.option('--config-file', '-c', required=True, help='configuration file',
-              type=click.File('r'))
-@click.option('--json', '-j', 'result_json', help='BANG JSON result file',
-              type=click.File('r'), required=True)
-@click.option('--identifiers', '-i', help='pickle with low quality identifiers',
-              required=True, type=click.File('rb'))
-@click.option('--no-functions', is_flag=True, default=False, help="do not use functions")
-@click.option('--no-variables', is_flag=True, default=False, help="do not use variables")
-@click.option('--no-strings', is_flag=True, default=False, help="do not use strings")
-def binary(config_file, result_json, identifiers, no_functions, no_variables, no_strings):
-    bang_type = 'binary'
-
-    # parse the configuration
-    yara_config = YaraConfig(config_file)
-    yara_env = yara_config.parse()
-
+def filter_identifiers(identifiers, minimum_length, maximum_length=None,
+                       lq_identifiers=None, skip_whitespace=False):
+    '''Filter identifiers on length and optionally remove whitespace-only
+       identifiers and low quality identifiers. Returns a set.'''
+    # filter in a single pass over the identifiers, as
+    # the identifiers can be a generator when streaming
+    if maximum_length is None:
+        maximum_length = sys.maxsize
+
+    if skip_whitespace:
+        filtered = {i for i in identifiers if minimum_length <= len(i) <= maximum_length
+                    and not i.isspace()}
+    else:
+        filtered = {i for i in identifiers if minimum_length <= len(i) <= maximum_length}
+
+    if lq_identifiers:
+        filtered -= lq_identifiers
+    return filtered
+
+def stream_json_items(json_file, prefix):
+    '''Lazily yield the items of the JSON array at prefix in a JSON file.'''
+    with open(json_file, 'rb') as result_json:
+        yield from ijson.items(result_json, prefix)
+
+def stream_bang_json(json_file, keys=('labels', 'metadata', 'tags'),
+                     array_keys=('strings', 'symbols', 'classes')):
+    '''Read a JSON file with ijson. Only the small top level values in
+       keys are read into memory, in a single pass over the file. The arrays
+       in array_keys are generators that read the file again when they
+       are consumed.'''
+    bang_data = {}
+
+    # bang_to_json.py writes the metadata and tags after the large
+    # arrays, so the values are collected from the parser events instead
+    # of searching the file for every key.
+    keys = frozenset(keys)
+    builder = None
+    depth = 0
+    with open(json_file, 'rb') as result_json:
+        for prefix, event, value in ijson.parse(result_json):
+            if builder is None:
+                # only the values of the top level keys have
+                # the key itself as their prefix.
+                if prefix not in keys:
+                    continue
+                builder = ijson.ObjectBuilder()
+                key = prefix
+
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+
+            if depth == 0:
+                bang_data[key] = builder.value
+                builder = None
+                if len(bang_data) == len(keys):
+                    break
+
+    for key in array_keys:
+        bang_data[key] = stream_json_items(json_file, f'{key}.item')
+    return bang_data
+
+def read_lq_identifiers(identifiers):
+    '''Read the pickle with low quality identifiers. Returns the
+       identifiers as frozensets so membership tests are cheap.'''
     # define a data structure with low quality
     # identifiers for ELF and Dex
-    lq_identifiers = {'elf': {'functions': [], 'variables': [], 'strings': []},
-                      'dex': {'functions': [], 'variables': [], 'strings': []}}
+    lq_identifiers = {'elf': {'functions': frozenset(), 'variables': frozenset(), 'strings': frozenset()},
+                      'dex': {'functions': frozenset(), 'variables': frozenset(), 'strings': frozenset()}}
 
     # read the pickle with low quality identifiers
     if identifiers is not None:
@@ -167,39 +273,69 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
         except pickle.UnpicklingError:
             pass
 
-    yara_directory = yara_env['yara_directory'] / 'binary'
-
-    yara_directory.mkdir(exist_ok=True)
-
-    # load the JSON
+    # pickles created by older versions of lq_to_pickle.py store
+    # the identifiers as lists, so convert these to frozensets.
+    for exec_type in lq_identifiers:
+        for identifier_type in lq_identifiers[exec_type]:
+            if not isinstance(lq_identifiers[exec_type][identifier_type], frozenset):
+                lq_identifiers[exec_type][identifier_type] = frozenset(lq_identifiers[exec_type][identifier_type])
+    return lq_identifiers
+
+def process_binary(json_file, no_functions, no_variables, no_strings, yara_env=None):
+    '''Generate a YARA rule for a single BANG JSON result file. Returns
+       the name of the JSON file, a message explaining why no rule was
+       generated (or None) and an exit code. If yara_env is not set the
+       configuration of the worker process is used.'''
+    if yara_env is None:
+        yara_env = worker_yara_env
+
+    # load the JSON. Very large files are streamed to
+    # avoid keeping all the identifiers in memory.
     try:
-        bang_data = json.load(result_json)
+        if ijson is not None and os.stat(json_file).st_size > STREAM_JSON_SIZE:
+            bang_data = stream_bang_json(json_file)
+        else:
+            with open(json_file, 'rb') as result_json:
+                bang_data = json_loads(result_json.read())
     except:
-        print("Could not open JSON, exiting", file=sys.stderr)
-        sys.exit(1)
+        return (json_file, "Could not open JSON", 1)
+
+    # A JSON file that is not a BANG result (for example when processing
+    # a directory) results in errors when looking up the data. Streamed
+    # files are only read when the data is used, so errors in the JSON
+    # itself can also still occur.
+    try:
+        return generate_binary_yara(json_file, bang_data, no_functions, no_variables,
+                                    no_strings, yara_env)
+    except INVALID_BANG_JSON_ERRORS:
+        return (json_file, "Invalid BANG JSON", 1)
+
+def generate_binary_yara(json_file, bang_data, no_functions, no_variables, no_strings, yara_env):
+    '''Generate a YARA rule from the data of a BANG JSON result file.
+       Returns the same values as process_binary()'''
+    bang_type = 'binary'
+    lq_identifiers = yara_env['lq_identifiers']
+
+    yara_directory = yara_env['yara_directory'] / 'binary'
 
     # no need to generate any YARA files for empty files
     if bang_data['metadata']['sha256'] == 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855':
-        print("Cannot generate YARA file for empty file, exiting", file=sys.stderr)
-        sys.exit(1)
+        return (json_file, "Cannot generate YARA file for empty file", 1)
 
     if 'labels' in bang_data:
         if 'ocaml' in bang_data['labels']:
             if yara_env['ignore_ocaml']:
-                print("OCAML file found that should be ignored, exiting", file=sys.stderr)
-                sys.exit()
+                return (json_file, "OCAML file found that should be ignored", 0)
         if 'elf' in bang_data['labels']:
             suffix = pathlib.Path(bang_data['metadata']['name']).suffix
 
             if suffix in IGNORED_ELF_SUFFIXES:
-                print("Ignored suffix, exiting", file=sys.stderr)
-                sys.exit()
+                return (json_file, "Ignored suffix", 0)
 
             if 'static' in bang_data['labels']:
                 if not 'linuxkernelmodule' in bang_data['labels']:
                     # TODO: clean up for linux kernel modules
-                    print("Static ELF binary not supported yet, exiting", file=sys.stderr)
-                    sys.exit()
+                    return (json_file, "Static ELF binary not supported yet", 0)
 
     tags = bang_data.get('tags', [])
 
@@ -212,8 +348,7 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
         exec_type = None
 
     if not exec_type:
-        print("Unsupported executable type, exiting", file=sys.stderr)
-        sys.exit(2)
+        return (json_file, "Unsupported executable type", 2)
 
     # set metadata
     metadata = bang_data['metadata']
@@ -230,16 +365,11 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
 
         # process strings
         if bang_data['strings'] != [] and not no_strings:
-            for s in bang_data['strings']:
-                if len(s) < yara_env['string_minimum_length']:
-                    continue
-                if len(s) > yara_env['string_maximum_length']:
-                    continue
-                # ignore whitespace-only strings
-                if re.match(r'^\s+$', s) is None:
-                    if s in lq_identifiers['elf']['strings']:
-                        continue
-                    strings.add(s.translate(ESCAPE))
+            # ignore whitespace-only strings
+            candidates = filter_identifiers(bang_data['strings'], yara_env['string_minimum_length'],
+                                            yara_env['string_maximum_length'],
+                                            lq_identifiers['elf']['strings'], skip_whitespace=True)
+            strings = {escape_yara(s) for s in candidates}
 
         # process symbols, split in functions and variables
         if bang_data['symbols'] != []:
@@ -258,14 +388,14 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
                 else:
                     identifier_name = s['name']
                 if s['type'] == 'func' and not no_functions:
-                    if identifier_name in lq_identifiers['elf']['functions']:
-                        continue
                     functions.add(identifier_name)
                 elif s['type'] == 'object' and not no_variables:
-                    if identifier_name in lq_identifiers['elf']['variables']:
-                        continue
                     variables.add(identifier_name)
 
+            # remove the low quality identifiers in one go
+            functions -= lq_identifiers['elf']['functions']
+            variables -= lq_identifiers['elf']['variables']
+
         # check if the number of identifiers passes a threshold.
         # If not assume that there are no identifiers.
         if len(strings) < heuristics['strings_extracted']:
@@ -279,48 +409,39 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
         for c in bang_data['classes']:
             # process methods/functions
             if not no_functions:
-                for method in c['methods']:
-                    # ignore whitespace-only methods
-                    if len(method['name']) < yara_env['identifier_cutoff']:
-                        continue
-                    if re.match(r'^\s+$', method['name']) is not None:
-                        continue
-                    if method['name'] in ['<init>', '<clinit>']:
-                        continue
-                    if method['name'].startswith('access$'):
-                        continue
-                    if method['name'] in lq_identifiers['dex']['functions']:
-                        continue
-                    functions.add(method['name'])
+                # ignore whitespace-only methods
+                method_names = filter_identifiers([method['name'] for method in c['methods']],
+                                                  yara_env['identifier_cutoff'], skip_whitespace=True)
+                method_names -= IGNORED_DEX_METHODS
+                functions.update(m for m in method_names if not m.startswith('access$'))
 
             # process strings
             if not no_strings:
                 for method in c['methods']:
-                    for s in method['strings']:
-                        if len(s) < yara_env['string_minimum_length']:
-                            continue
-                        if len(s) > yara_env['string_maximum_length']:
-                            continue
-                        # ignore whitespace-only strings
-                        if re.match(r'^\s+$', s) is None:
-                            strings.add(s.translate(ESCAPE))
+                    # ignore whitespace-only strings
+                    method_strings = filter_identifiers(method['strings'], yara_env['string_minimum_length'],
+                                                        yara_env['string_maximum_length'], skip_whitespace=True)
+                    strings.update(escape_yara(s) for s in method_strings)
 
             # process fields/variables
             if not no_variables:
-                for field in c['fields']:
-                    # ignore whitespace-only methods
-                    if len(field['name']) < yara_env['identifier_cutoff']:
-                        continue
-                    if re.match(r'^\s+$', field['name']) is not None:
-                        continue
+                # ignore whitespace-only fields
+                variables.update(filter_identifiers([field['name'] for field in c['fields']],
+                                                    yara_env['identifier_cutoff'], skip_whitespace=True))
 
-                    if field['name'] in lq_identifiers['dex']['variables']:
-                        continue
-                    variables.add(field['name'])
+        # remove the low quality identifiers in one go
+        functions -= lq_identifiers['dex']['functions']
+        variables -= lq_identifiers['dex']['variables']
 
     # do not generate a YARA file if there is no data
     if strings == set() and variables == set() and functions == set():
-        return
+        return (json_file, None, 0)
+
+    # sort the identifiers once so they are printed in
+    # sorted order in the YARA rule as well
+    strings = sorted(strings)
+    variables = sorted(variables)
+    functions = sorted(functions)
 
     yara_tags = sorted(set(tags + [exec_type]))
 
@@ -337,20 +458,164 @@ def binary(config_file, result_json, identifiers, no_functions, no_variables, no
     if yara_env['fullword']:
         fullword = ' fullword'
 
-    num_strings = num_funcs = num_vars = 'any'
+    num_strings, num_funcs, num_vars = condition_numbers(heuristics, len(strings),
+                                                         len(functions), len(variables))
+
+    rule_uuid = generate_yara(yara_file, metadata, functions, variables, strings,
+                              yara_tags, num_strings, num_funcs, num_vars,
+                              fullword, yara_env['operator'], bang_type,
+                              yara_env['generate_date'])
+    return (json_file, None, 0)
+
+def process_identifiers(json_file, package, package_versions,
+                        yara_directory, tags, fullword, yara_env=None):
+    '''Generate a YARA rule for identifiers extracted from a single version
+       of a package. Returns the metadata and the identifiers, so they can be
+       aggregated, or None if the file is not for one of the package versions.
+       If yara_env is not set the configuration of the worker process is used.'''
+    bang_type = "source"
+    if yara_env is None:
+        yara_env = worker_yara_env
+    lq_identifiers = yara_env['lq_identifiers']
+    heuristics = yara_env['heuristics']
 
-    if len(strings) >= heuristics['strings_minimum_present']:
-        num_strings = str(int(max(len(strings)//heuristics['strings_percentage'], heuristics['strings_matched'])))
+    # sanity check for the package. If ijson is available only the
+    # metadata is read first, so files for other packages or versions
+    # are not parsed completely.
+    try:
+        if ijson is not None:
+            json_results = stream_bang_json(json_file, keys=('metadata',),
+                                            array_keys=('strings', 'functions', 'variables'))
+        else:
+            with open(json_file, 'rb') as json_archive:
+                json_results = json_loads(json_archive.read())
+
+        if json_results['metadata']['package'] != package:
+            return None
+        if json_results['metadata'].get('packageurl') not in package_versions:
+            return None
+
+        # only very large files are streamed, other
+        # files are parsed in one go as that is faster.
+        if ijson is not None and os.stat(json_file).st_size <= STREAM_JSON_SIZE:
+            with open(json_file, 'rb') as json_archive:
+                json_results = json_loads(json_archive.read())
+
+        yara_directory.mkdir(parents=True, exist_ok=True)
+
+        metadata = json_results['metadata']
+        metadata['name'] = metadata['archive']
+        language = metadata['language']
+
+        strings = filter_identifiers(json_results['strings'], yara_env['string_minimum_length'],
+                                     yara_env['string_maximum_length'])
+        functions = filter_identifiers(json_results['functions'], yara_env['identifier_cutoff'])
+        variables = filter_identifiers(json_results['variables'], yara_env['identifier_cutoff'])
+
+        # The identifiers are only filtered on length for the aggregation,
+        # as which low quality identifiers are removed there depends on
+        # the language that is aggregated, not on the language of the file.
+        result = {'json_file': json_file, 'metadata': metadata, 'strings': strings,
+                  'functions': functions, 'variables': variables}
+
+        # low quality identifiers are only used for C, mapped to ELF
+        if language == 'c':
+            strings = strings - lq_identifiers['elf']['strings']
+            functions = functions - lq_identifiers['elf']['functions']
+            variables = variables - lq_identifiers['elf']['variables']
+
+        strings = sorted(strings)
+        variables = sorted(variables)
+        functions = sorted(functions)
+
+        num_strings, num_funcs, num_vars = condition_numbers(heuristics, len(strings),
+                                                             len(functions), len(variables))
 
-    if len(functions) >= heuristics['functions_minimum_present']:
-        num_funcs = str(int(max(len(functions)//heuristics['functions_percentage'], heuristics['functions_matched'])))
+        if not (strings == [] and variables == [] and functions == []):
+            yara_tags = sorted(set(tags + [language]))
+            yara_file = yara_directory / (f"{metadata['archive']}-{metadata['language']}.yara")
+            rule_uuid = generate_yara(yara_file, metadata, functions, variables, strings,
+                                      yara_tags, num_strings, num_funcs, num_vars,
+                                      fullword, yara_env['operator'], bang_type,
+                                      yara_env['generate_date'])
+        return result
+    except Exception as e:
+        return None
 
-    if len(variables) >= heuristics['variables_minimum_present']:
-        num_vars = str(int(max(len(variables)//heuristics['variables_percentage'], heuristics['variables_matched'])))
+@click.group()
+def app():
+    pass
+
+@app.command(short_help='process BANG JSON result files and output YARA rules for binaries')
+@click.option('--config-file', '-c', required=True, help='configuration file',
+              type=click.File('r'))
+@click.option('--json', '-j', 'result_json', help='BANG JSON result file',
+              type=click.Path(exists=True, path_type=pathlib.Path))
+@click.option('--json-directory', '-d', help='directory with BANG JSON result files',
+              type=click.Path(exists=True, path_type=pathlib.Path))
+@click.option('--identifiers', '-i', help='pickle with low quality identifiers',
+              required=True, type=click.File('rb'))
+@click.option('--no-functions', is_flag=True, default=False, help="do not use functions")
+@click.option('--no-variables', is_flag=True, default=False, help="do not use variables")
+@click.option('--no-strings', is_flag=True, default=False, help="do not use strings")
+def binary(config_file, result_json, json_directory, identifiers, no_functions, no_variables, no_strings):
+    '''Generate YARA files from identifiers extracted from binaries, either
+       from a single JSON file or from all JSON files in a directory.'''
+    if (result_json is None) == (json_directory is None):
+        print("Specify either a JSON file or a JSON directory, exiting", file=sys.stderr)
+        sys.exit(1)
 
-    rule_uuid = generate_yara(yara_file, metadata, sorted(functions), sorted(variables),
-                              sorted(strings), yara_tags, num_strings, num_funcs, num_vars,
-                              fullword, yara_env['operator'], bang_type)
+    if json_directory is not None and not json_directory.is_dir():
+        print(f"{json_directory} is not a directory, exiting.", file=sys.stderr)
+        sys.exit(1)
+
+    # parse the configuration
+    yara_config = YaraConfig(config_file)
+    yara_env = yara_config.parse()
+
+    # use the same date for all rules generated in this run
+    yara_env['generate_date'] = datetime.datetime.utcnow().isoformat()
+
+    # read the low quality identifiers for ELF and Dex
+    yara_env['lq_identifiers'] = read_lq_identifiers(identifiers)
+
+    yara_directory = yara_env['yara_directory'] / 'binary'
+
+    yara_directory.mkdir(exist_ok=True)
+
+    if result_json is not None:
+        json_file, message, exit_code = process_binary(result_json, no_functions, no_variables,
+                                                       no_strings, yara_env)
+        if message is not None:
+            print(f"{message}, exiting", file=sys.stderr)
+            sys.exit(exit_code)
+        return
+
+    # process all the JSON files in the directory in parallel,
+    # as every file can be processed independently. The configuration
+    # is passed to the workers once, when they are started.
+    json_files = [f for f in json_directory.glob('**/*.json') if f.is_file()]
+
+    process_json = functools.partial(process_binary, no_functions=no_functions,
+                                     no_variables=no_variables, no_strings=no_strings)
+
+    # files that could not be processed are always reported,
+    # files that were skipped only in verbose mode.
+    failed_files = 0
+    with multiprocessing.Pool(yara_env['threads'], initializer=init_worker,
+                              initargs=(yara_env,)) as pool:
+        for json_file, message, exit_code in pool.imap_unordered(process_json, json_files):
+            if message is None:
+                continue
+            if exit_code == 1:
+                failed_files += 1
+                print(f"{json_file}: {message}", file=sys.stderr)
+            elif yara_env['verbose']:
+                print(f"{json_file}: {message}", file=sys.stderr)
+
+    if failed_files != 0:
+        print(f"{failed_files} JSON file(s) could not be processed", file=sys.stderr)
+        sys.exit(1)
 
 @app.command(short_help='process JSON files with identifiers extracted from source code and output YARA rules')
 @click.option('--config-file', '-c', required=True, help='configuration file',
@@ -391,7 +656,9 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
         print("invalid YAML:", e.args, file=sys.stderr)
         sys.exit(1)
 
-    packages = []
+    # store the metadata and identifiers for each package so the JSON
+    # files do not have to be read and parsed again during aggregation
+    packages = {}
 
     package = package_meta_information['package']
 
@@ -404,8 +671,24 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
 
     package_versions = set()
 
+    # versions that are the top level package url plus a plain version
+    # do not need to be parsed and checked as a package url. This
+    # cannot be used if the top level package url has qualifiers or a
+    # subpath, as these are written after the version.
+    purl_prefix = None
+    if not (top_purl.qualifiers or top_purl.subpath):
+        purl_prefix = packageurl.PackageURL(type=top_purl.type, namespace=top_purl.namespace,
+                                            name=top_purl.name).to_string() + '@'
+
     for release in package_meta_information['releases']:
         for version in release:
+            if purl_prefix is not None and version.startswith(purl_prefix):
+                purl_version = version[len(purl_prefix):]
+                if purl_version != '' and not PURL_SPECIAL_CHARACTERS.intersection(purl_version):
+                    if versions == () or purl_version in versions:
+                        package_versions.add(version)
+                    continue
+
             # verify that the version is a valid package url
             try:
                 purl = packageurl.PackageURL.from_string(version)
@@ -435,19 +718,14 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
 
     # mapping for low quality identifiers. C is mapped to ELF,
     # Java is mapped to Dex. TODO: use something a bit more sensible.
-    lq_identifiers = {'elf': {'functions': [], 'variables': [], 'strings': []},
-                      'dex': {'functions': [], 'variables': [], 'strings': []}}
-
-    # read the pickle with identifiers
-    if identifiers is not None:
-        try:
-            lq_identifiers = pickle.load(identifiers)
-        except pickle.UnpicklingError:
-            pass
+    lq_identifiers = read_lq_identifiers(identifiers)
 
     # expand yara_env with source scanning specific values
     yara_env['lq_identifiers'] = lq_identifiers
 
+    # use the same date for all rules generated in this run
+    yara_env['generate_date'] = datetime.datetime.utcnow().isoformat()
+
     yara_directory = yara_env['yara_directory'] / 'src' / top_purl.type / top_purl.name
 
     # store the languages and store the minimum per
@@ -460,98 +738,55 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
 
     tags = ['source']
 
-    # first instantiate the heuristics
-    heuristics = copy.deepcopy(yara_env['heuristics'])
-
     fullword = ''
     if yara_env['fullword']:
         fullword = ' fullword'
 
-    # process all the JSON files in the directory
-    for result_file in json_directory.glob('**/*'):
-        # sanity check for the package
-        try:
-            with open(result_file, 'r') as json_archive:
-                json_results = json.load(json_archive)
-
-                if json_results['metadata']['package'] == package:
-                    if json_results['metadata'].get('packageurl') in package_versions:
-                        yara_directory.mkdir(parents=True, exist_ok=True)
-                        strings = set()
-                        functions = set()
-                        variables = set()
-
-                        metadata = json_results['metadata']
-                        metadata['name'] = metadata['archive']
-
-                        packages.append(result_file)
-                        language = json_results['metadata']['language']
-                        languages.add(language)
-
-                        if language not in min_per_language:
-                            min_per_language[language] = {}
-                            min_per_language[language]['strings'] = sys.maxsize
-                            min_per_language[language]['variables'] = sys.maxsize
-                            min_per_language[language]['functions'] = sys.maxsize
-
-                            all_identifiers_per_language[language] = {}
-                            all_identifiers_per_language[language]['strings'] = set()
-                            all_identifiers_per_language[language]['functions'] = set()
-                            all_identifiers_per_language[language]['variables'] = set()
-
-                        for string in json_results['strings']:
-                            if len(string) >= yara_env['string_minimum_length'] and len(string) <= yara_env['string_maximum_length']:
-                                if language == 'c':
-                                    if string in lq_identifiers['elf']['strings']:
-                                        continue
-                                all_identifiers_per_language[language]['strings'].add(string)
-                                strings.add(string)
-
-                        for function in json_results['functions']:
-                            if len(function) < yara_env['identifier_cutoff']:
-                                continue
-                            if language == 'c':
-                                if function in lq_identifiers['elf']['functions']:
-                                    continue
-                            all_identifiers_per_language[language]['functions'].add(function)
-                            functions.add(function)
-
-                        for variable in json_results['variables']:
-                            if len(variable) < yara_env['identifier_cutoff']:
-                                continue
-                            if language == 'c':
-                                if variable in lq_identifiers['elf']['variables']:
-                                    continue
-                            all_identifiers_per_language[language]['variables'].add(variable)
-                            variables.add(variable)
-
-                        strings = sorted(strings)
-                        variables = sorted(variables)
-                        functions = sorted(functions)
-
-                        num_strings = num_funcs = num_vars = 'any'
-
-                        if len(strings) >= heuristics['strings_minimum_present']:
-                            num_strings = str(int(max(len(strings)//heuristics['strings_percentage'], heuristics['strings_matched'])))
-
-                        if len(functions) >= heuristics['functions_minimum_present']:
-                            num_funcs = str(int(max(len(functions)//heuristics['functions_percentage'], heuristics['functions_matched'])))
-
-                        if len(variables) >= heuristics['variables_minimum_present']:
-                            num_vars = str(int(max(len(variables)//heuristics['variables_percentage'], heuristics['variables_matched'])))
-
-                        if not (strings == [] and variables == [] and functions == []):
-                            yara_tags = sorted(set(tags + [language]))
-                            yara_file = yara_directory / (f"{metadata['archive']}-{metadata['language']}.yara")
-                            rule_uuid = generate_yara(yara_file, metadata, functions, variables, strings,
-                                                      yara_tags, num_strings, num_funcs, num_vars,
-                                                      fullword, yara_env['operator'], bang_type)
-
-        except Exception as e:
-            continue
+    # process all the JSON files in the directory in parallel. The
+    # workers return the identifiers that are needed for aggregation.
+    # Only JSON files are considered, directories and other files
+    # are skipped without opening them. The configuration, including
+    # the low quality identifiers, is passed to the workers only once.
+    json_files = [f for f in json_directory.rglob('*.json') if f.is_file()]
+
+    process_json = functools.partial(process_identifiers, package=package,
+                                     package_versions=package_versions,
+                                     yara_directory=yara_directory, tags=tags,
+                                     fullword=fullword)
+
+    with multiprocessing.Pool(yara_env['threads'], initializer=init_worker,
+                              initargs=(yara_env,)) as pool:
+        for result in pool.imap_unordered(process_json, json_files, chunksize=16):
+            if result is None:
+                continue
+
+            packages[result['json_file']] = result
+            language = result['metadata']['language']
+            languages.add(language)
+
+            if language not in min_per_language:
+                min_per_language[language] = {}
+                min_per_language[language]['strings'] = sys.maxsize
+                min_per_language[language]['variables'] = sys.maxsize
+                min_per_language[language]['functions'] = sys.maxsize
+
+                all_identifiers_per_language[language] = {}
+                all_identifiers_per_language[language]['strings'] = set()
+                all_identifiers_per_language[language]['functions'] = set()
+                all_identifiers_per_language[language]['variables'] = set()
+
+            # low quality identifiers are only used for C, mapped to ELF
+            if language == 'c':
+                all_identifiers_per_language[language]['strings'].update(result['strings'] - lq_identifiers['elf']['strings'])
+                all_identifiers_per_language[language]['functions'].update(result['functions'] - lq_identifiers['elf']['functions'])
+                all_identifiers_per_language[language]['variables'].update(result['variables'] - lq_identifiers['elf']['variables'])
+            else:
+                all_identifiers_per_language[language]['strings'].update(result['strings'])
+                all_identifiers_per_language[language]['functions'].update(result['functions'])
+                all_identifiers_per_language[language]['variables'].update(result['variables'])
 
     # exit if there are no valid packages
-    if packages == []:
+    if packages == {}:
         print("No packages for processing found", file=sys.stderr)
         sys.exit(1)
 
@@ -564,70 +799,52 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
 
     # TODO: sort the packages based on version number
     for language in languages:
-        # read the JSON again, this time aggregate the data
-        all_strings_intersection = set()
-        all_functions_intersection = set()
-        all_variables_intersection = set()
+        # collect the identifiers that were extracted per package version,
+        # so the intersection can be computed in one go
+        all_strings = []
+        all_functions = []
+        all_variables = []
 
         website = ''
         cpe = ''
         cpe23 = ''
 
-        # keep track of if the first element is being processed
-        is_start = True
-
-        for package in packages:
-            with open(package, 'r') as json_archive:
-                json_results = json.load(json_archive)
-
-                if website == '':
-                    website = json_results['metadata']['website']
-
-                if cpe == '':
-                    cpe = json_results['metadata']['cpe']
-                if cpe23 == '':
-                    cpe23 = json_results['metadata']['cpe23']
-
-                strings = set()
-
-                if not no_strings:
-                    for string in json_results['strings']:
-                        if len(string) >= yara_env['string_minimum_length'] and len(string) <= yara_env['string_maximum_length']:
-                            if language == 'c':
-                                if string in lq_identifiers['elf']['strings']:
-                                    continue
-                            strings.add(string)
-
-                functions = set()
-
-                if not no_functions:
-                    for function in json_results['functions']:
-                        if len(function) < yara_env['identifier_cutoff']:
-                            continue
-                        if language == 'c':
-                            if function in lq_identifiers['elf']['functions']:
-                                continue
-                        functions.add(function)
-
-                if not no_variables:
-                    variables = set()
-                    for variable in json_results['variables']:
-                        if len(variable) < yara_env['identifier_cutoff']:
-                            continue
-                        if language == 'c':
-                            if variable in lq_identifiers['elf']['variables']:
-                                continue
-                        variables.add(variable)
-
-                if is_start:
-                    all_strings_intersection.update(strings)
-                    all_functions_intersection.update(functions)
-                    all_variables_intersection.update(variables)
-                    is_start = False
-                else:
-                    all_strings_intersection &= strings
-                    all_functions_intersection &= functions
-                    all_variables_intersection &= variables
+        for result in packages.values():
+            if website == '':
+                website = result['metadata']['website']
+
+            if cpe == '':
+                cpe = result['metadata']['cpe']
+            if cpe23 == '':
+                cpe23 = result['metadata']['cpe23']
+
+            strings = set()
+            functions = set()
+            variables = set()
+
+            # the identifiers were already filtered on length
+            if not no_strings:
+                strings = result['strings']
+
+            if not no_functions:
+                functions = result['functions']
+
+            if not no_variables:
+                variables = result['variables']
+
+            # low quality identifiers are only used for C, mapped to ELF
+            if language == 'c':
+                strings = strings - lq_identifiers['elf']['strings']
+                functions = functions - lq_identifiers['elf']['functions']
+                variables = variables - lq_identifiers['elf']['variables']
+
+            all_strings.append(strings)
+            all_functions.append(functions)
+            all_variables.append(variables)
+
+        all_strings_intersection = set.intersection(*all_strings)
+        all_functions_intersection = set.intersection(*all_functions)
+        all_variables_intersection = set.intersection(*all_variables)
 
         # sort the identifiers so they are printed in
         # sorted order in the YARA rule as well
@@ -639,16 +856,24 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
         # found in a package.
 
         # first instantiate the heuristics
-        heuristics = copy.deepcopy(yara_env['heuristics'])
+        heuristics = dict(yara_env['heuristics'])
 
         # then change the percentage based on the minimum
-        # amount of identifiers, and the union
-        heuristics['strings_percentage'] = min(heuristics['strings_percentage'],
-                                               heuristics['strings_percentage'] * min_per_language[language]['strings'] / len(strings))
-        heuristics['functions_percentage'] = min(heuristics['functions_percentage'],
-                                                heuristics['functions_percentage'] * min_per_language[language]['functions'] / len(functions))
-        heuristics['variables_percentage'] = min(heuristics['variables_percentage'],
-                                                 heuristics['variables_percentage'] * min_per_language[language]['variables'] / len(variables))
+        # amount of identifiers, and the union. The percentage
+        # can only become lower if the minimum is smaller than the
+        # union. It is not changed if the minimum is 0, as the
+        # percentage is used as a divisor later.
+        len_strings = len(strings)
+        len_functions = len(functions)
+        len_variables = len(variables)
+        minimum = min_per_language[language]
+
+        if 0 < minimum['strings'] < len_strings:
+            heuristics['strings_percentage'] = heuristics['strings_percentage'] * minimum['strings'] / len_strings
+        if 0 < minimum['functions'] < len_functions:
+            heuristics['functions_percentage'] = heuristics['functions_percentage'] * minimum['functions'] / len_functions
+        if 0 < minimum['variables'] < len_variables:
+            heuristics['variables_percentage'] = heuristics['variables_percentage'] * minimum['variables'] / len_variables
 
         # finally generate union and intersection files
         # that operate on all versions of a package
@@ -657,30 +882,23 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
                     'package': top_purl.name, 'packageurl': top_purl,
                     'website': website, 'cpe': cpe, 'cpe23': cpe23}
 
-        if not (strings == [] and variables == [] and functions == []):
-            num_strings = num_funcs = num_vars = 'any'
-
-            if len(strings) >= heuristics['strings_minimum_present']:
-                num_strings = str(int(max(len(strings)//heuristics['strings_percentage'], heuristics['strings_matched'])))
-
-            if len(functions) >= heuristics['functions_minimum_present']:
-                num_funcs = str(int(max(len(functions)//heuristics['functions_percentage'], heuristics['functions_matched'])))
-
-            if len(variables) >= heuristics['variables_minimum_present']:
-                num_vars = str(int(max(len(variables)//heuristics['variables_percentage'], heuristics['variables_matched'])))
+        if not (len_strings == 0 and len_variables == 0 and len_functions == 0):
+            num_strings, num_funcs, num_vars = condition_numbers(heuristics, len_strings,
+                                                                 len_functions, len_variables)
 
             yara_file = yara_directory / (f"{metadata['archive']}-{metadata['language']}.yara")
             yara_tags = sorted(set(tags + [language]))
             rule_uuid = generate_yara(yara_file, metadata, functions, variables, strings,
                                       yara_tags, num_strings, num_funcs, num_vars,
-                                      fullword, yara_env['operator'], bang_type)
+                                      fullword, yara_env['operator'], bang_type,
+                                      yara_env['generate_date'])
 
         strings = sorted(all_strings_intersection)
         variables = sorted(all_variables_intersection)
         functions = sorted(all_functions_intersection)
 
         # reset heuristics
-        heuristics = copy.deepcopy(yara_env['heuristics'])
+        heuristics = dict(yara_env['heuristics'])
 
         archive_name = f'{top_purl.name}-intersection'
         metadata = {'archive': archive_name, 'name': archive_name, 'language': language,
@@ -688,23 +906,16 @@ def source(config_file, json_directory, identifiers, meta, no_functions, no_vari
                     'website': website, 'cpe': cpe, 'cpe23': cpe23}
 
         if not (strings == [] and variables == [] and functions == []):
-            num_strings = num_funcs = num_vars = 'any'
-
-            if len(strings) >= heuristics['strings_minimum_present']:
-                num_strings = str(int(max(len(strings)//heuristics['strings_percentage'], heuristics['strings_matched'])))
-
-            if len(functions) >= heuristics['functions_minimum_present']:
-                num_funcs = str(int(max(len(functions)//heuristics['functions_percentage'], heuristics['functions_matched'])))
-
-            if len(variables) >= heuristics['variables_minimum_present']:
-                num_vars = str(int(max(len(variables)//heuristics['variables_percentage'], heuristics['variables_matched'])))
+            num_strings, num_funcs, num_vars = condition_numbers(heuristics, len(strings),
+                                                                 len(functions), len(variables))
 
             yara_file = yara_directory / (f"{metadata['archive']}-{metadata['language']}.yara")
 
             yara_tags = sorted(set(tags + [language]))
             rule_uuid = generate_yara(yara_file, metadata, functions, variables, strings,
                                       yara_tags, num_strings, num_funcs, num_vars,
-                                      fullword, yara_env['operator'], bang_type)
+                                      fullword, yara_env['operator'], bang_type,
+                                      yara_env['generate_date'])
 
 
 if __name__ == "__main__":
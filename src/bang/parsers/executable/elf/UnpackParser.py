@@ -23,6 +23,8 @@ import hashlib
 import io
 import json
 import pathlib
+import re
+import struct
 
 import elftools
 import pwn
@@ -36,41 +38,69 @@ from bang.UnpackParserException import UnpackParserException
 from . import elf
 from . import zdebug
 
+# pretty printed values for the ELF class, data encoding and type
+ELF_BITS = {elf.Elf.Bits.b32: 32, elf.Elf.Bits.b64: 64}
+
+ELF_ENDIAN = {elf.Elf.Endian.le: 'little', elf.Elf.Endian.be: 'big'}
+
+ELF_TYPES = {elf.Elf.ObjType.no_file_type: None,
+             elf.Elf.ObjType.relocatable: 'relocatable',
+             elf.Elf.ObjType.executable: 'executable',
+             elf.Elf.ObjType.shared: 'shared',
+             elf.Elf.ObjType.core: 'core'}
+
+# ELF types that can be derived from just the name of a note
+#
+# NetBSD: https://www.netbsd.org/docs/kernel/elf-notes.html
+# Xen: http://xenbits.xen.org/gitweb/?p=xen.git;a=blob;f=xen/include/public/elfnote.h;h=181cbc4ec71c4af298e40c3604daff7d3b48d52f;hb=HEAD
+# (.note.Xen in FreeBSD kernel, .notes in Linux kernel)
+NOTE_ELF_TYPES = {b'FreeBSD': 'freebsd', b'OpenBSD': 'openbsd',
+                  b'NetBSD': 'netbsd', b'Xen': 'xen',
+                  b'NaCl': 'Google Native Client'}
+
+# the Linux version in a GNU ABI tag note: three 32 bit values
+# following the 32 bit OS identifier, in the byte order of the ELF file
+ABI_TAG_VERSION = {'little': struct.Struct('<III'), 'big': struct.Struct('>III')}
+
+# the Android API level in an Android ident note: always little endian
+ANDROID_API_LEVEL = struct.Struct('<I')
+
+# minimum amount of bytes needed for TLSH to compute a hash
+TLSH_MINIMUM = 50
+
 # a list of (partial) names of functions that have been
 # compiled with FORTIFY_SOURCE. This list is not necessarily
 # complete, but at least catches some verified functions.
-FORTIFY_NAMES = ['cpy_chk', 'printf_chk', 'cat_chk', 'poll_chk',
+# This is a tuple so it can be passed to str.endswith() directly.
+FORTIFY_NAMES = ('cpy_chk', 'printf_chk', 'cat_chk', 'poll_chk',
                  'read_chk', '__memset_chk', '__memmove_chk',
                  'syslog_chk', '__longjmp_chk', '__fdelt_chk',
                  '__realpath_chk', '__explicit_bzero_chk', '__recv_chk',
-                 '__getdomainname_chk', '__gethostname_chk']
+                 '__getdomainname_chk', '__gethostname_chk')
+
+# Linux kernel module information in .modinfo is stored as
+# NUL separated key=value strings. Only match keys at the start
+# of such a string, and not somewhere in the middle of a value.
+RE_MODINFO = re.compile(rb'(?<![^\x00])(name|license|author|description|vermagic|depends)=([^\x00]*)')
 
 # some names used in OCaml
-OCAML_NAMES = ['caml_c_cal', 'caml_init_atom_table',
-               'caml_init_backtrace', 'caml_init_custom_operations',
-               'caml_init_domain', 'caml_init_frame_descriptors',
-               'caml_init_gc', 'caml_init_ieee_floats',
-               'caml_init_locale', 'caml_init_major_heap',
-               'caml_init_signals', 'caml_sys_error',
-               'caml_sys_executable_name', 'caml_sys_exit',
-               'caml_sys_file_exists', 'caml_sys_get_argv',
-               'caml_sys_get_config', 'caml_sys_getcwd',
-               'caml_sys_getenv', 'caml_sys_init']
+OCAML_NAMES = frozenset(['caml_c_cal', 'caml_init_atom_table',
+                         'caml_init_backtrace', 'caml_init_custom_operations',
+                         'caml_init_domain', 'caml_init_frame_descriptors',
+                         'caml_init_gc', 'caml_init_ieee_floats',
+                         'caml_init_locale', 'caml_init_major_heap',
+                         'caml_init_signals', 'caml_sys_error',
+                         'caml_sys_executable_name', 'caml_sys_exit',
+                         'caml_sys_file_exists', 'caml_sys_get_argv',
+                         'caml_sys_get_config', 'caml_sys_getcwd',
+                         'caml_sys_getenv', 'caml_sys_init'])
 
 # road only data sections. This should be expanded.
 RODATA_SECTIONS = ['.rodata', '.rodata.str1.1', '.rodata.str1.4',
                    '.rodata.str1.8', '.rodata.cst4', '.rodata.cst8',
                    '.rodata.cst16', 'rodata']
 
-# sections with interesting data found in guile programs
-GUILE_STRTAB_SECTIONS = ['.guile.arities.strtab', '.guile.docstrs.strtab']
-
 # characters to be removed when extracting strings
-REMOVE_CHARACTERS = ['\a', '\b', '\v', '\f', '\x01', '\x02', '\x03', '\x04',
-                     '\x05', '\x06', '\x0e', '\x0f', '\x10', '\x11', '\x12',
-                     '\x13', '\x14', '\x15', '\x16', '\x17', '\x18', '\x19',
-                     '\x1a', '\x1b', '\x1c', '\x1d', '\x1e', '\x1f', '\x7f']
-
 REMOVE_CHARACTERS_TABLE = str.maketrans({'\a': '', '\b': '', '\v': '',
                                          '\f': '', '\x01': '', '\x02': '',
                                          '\x03': '', '\x04': '', '\x05': '',
@@ -91,6 +121,27 @@ STRING_TRANSLATION_TABLE = str.maketrans({'\t': ' '})
 HASH_ALGORITHMS = ['sha256', 'md5', 'sha1']
 
 
+# telfhash results per SHA256 of a file. Firmware often contains
+# several copies of the same ELF file, for example in different
+# partitions. This cache is per process and holds at most
+# TELFHASH_CACHE_SIZE results, the oldest result is removed first.
+TELFHASH_CACHE = {}
+TELFHASH_CACHE_SIZE = 4096
+
+
+def compute_telfhash(file_path):
+    '''Compute the telfhash for an ELF file, or None if there is none'''
+    try:
+        telfhash_result = telfhash.telfhash(str(file_path))
+        if telfhash_result != []:
+            telfhash_res = telfhash_result[0]['telfhash'].upper()
+            if telfhash_res not in ['TNULL', '-']:
+                return telfhash_res
+    except UnicodeEncodeError:
+        pass
+    return None
+
+
 class ElfUnpackParser(UnpackParser):
     extensions = []
     signatures = [
@@ -212,27 +263,21 @@ class ElfUnpackParser(UnpackParser):
                             num_dynsym = len(header.body.entries)
 
                 for header in self.data.header.section_headers:
-                    if header.type == elf.Elf.ShType.nobits:
+                    section_type = header.type
+                    if section_type == elf.Elf.ShType.nobits:
                         continue
 
                     # ugly ugly hack to work around situations on Android where
                     # ELF files have been split into individual sections and all
-                    # offsets are wrong.
-                    if header.type == elf.Elf.ShType.note:
-                        for entry in header.body.entries:
-                            pass
-                    elif header.type == elf.Elf.ShType.strtab:
-                        for entry in header.body.entries:
-                            pass
+                    # offsets are wrong. The entries of these sections are all
+                    # read when the body is parsed.
+                    if section_type in [elf.Elf.ShType.note, elf.Elf.ShType.strtab]:
+                        body = header.body
 
                     # force read the header name
-                    name = header.name
-                    if header.type == elf.Elf.ShType.symtab:
-                        if header.name == '.symtab':
-                            for entry in header.body.entries:
-                                name = entry.name
-                    if header.type == elf.Elf.ShType.dynamic:
-                        if header.name == '.dynamic':
+                    section_name = header.name
+                    if section_type == elf.Elf.ShType.dynamic:
+                        if section_name == '.dynamic':
                             for entry in header.body.entries:
                                 if entry.tag_enum == elf.Elf.DynamicArrayTags.needed:
                                     name = entry.value_str
@@ -243,42 +288,40 @@ class ElfUnpackParser(UnpackParser):
                                 elif entry.tag_enum == elf.Elf.DynamicArrayTags.soname:
                                     name = entry.value_str
 
-                    # force check symbols
-                    elif header.type == elf.Elf.ShType.symtab:
-                        if header.name == '.symtab':
+                    # force check symbols. Only the values that are read
+                    # lazily and could fail are accessed, the other fields
+                    # were already read when the body was parsed.
+                    elif section_type == elf.Elf.ShType.symtab:
+                        if section_name == '.symtab':
                             for entry in header.body.entries:
                                 name = entry.name
                                 name = entry.type.name
                                 name = entry.bind.name
                                 name = entry.visibility.name
-                                name = entry.sh_idx
-                                name = entry.size
-                    elif header.type == elf.Elf.ShType.dynsym:
-                        if header.name == '.dynsym':
+                    elif section_type == elf.Elf.ShType.dynsym:
+                        if section_name == '.dynsym':
                             for entry in header.body.entries:
                                 name = entry.name
                                 name = entry.type.name
                                 name = entry.bind.name
                                 name = entry.visibility.name
-                                name = entry.sh_idx
-                                name = entry.size
 
                     # force check reading data
-                    elif header.type == elf.Elf.ShType.progbits:
-                        if header.name in RODATA_SECTIONS:
-                            body = header.body
+                    elif section_type == elf.Elf.ShType.progbits:
+                        if section_name in RODATA_SECTIONS:
+                            body = header.raw_body
 
                     # Symbol versioning
                     # see https://johannst.github.io/notes/development/symbolver.html
                     # for a good explanation of these symbols
-                    elif header.type == elf.Elf.ShType.gnu_versym:
-                        if header.name == '.gnu.version':
+                    elif section_type == elf.Elf.ShType.gnu_versym:
+                        if section_name == '.gnu.version':
                             check_condition(self.dynstr is not None, "no dynamic string section found")
                             check_condition(num_dynsym == len(header.body.symbol_versions),
                                             "mismatch between number of symbols and symbol versions")
                             self.symbol_to_version = {k: v.version for k, v in enumerate(header.body.symbol_versions)}
-                    elif header.type == elf.Elf.ShType.gnu_verneed:
-                        if header.name == '.gnu.version_r':
+                    elif section_type == elf.Elf.ShType.gnu_verneed:
+                        if section_name == '.gnu.version_r':
                             check_condition(self.dynstr is not None, "no dynamic string section found")
 
                             cur_entry = header.body.entry
@@ -308,8 +351,8 @@ class ElfUnpackParser(UnpackParser):
                                     cur_entry = cur_entry.next
                                 else:
                                     break
-                    elif header.type == elf.Elf.ShType.gnu_verdef:
-                        if header.name == '.gnu.version_d':
+                    elif section_type == elf.Elf.ShType.gnu_verdef:
+                        if section_name == '.gnu.version_d':
                             check_condition(self.dynstr is not None, "no dynamic string section found")
                             cur_entry = header.body.entry
                             self.version_to_name[0] = ''
@@ -325,7 +368,7 @@ class ElfUnpackParser(UnpackParser):
                                         a_name = self.dynstr.read().split(b'\x00')[0].decode()
                                         if aux_name == '':
                                             aux_name = a_name
-                                        check_condition(name != '', "empty name")
+                                        check_condition(section_name != '', "empty name")
                                     except UnicodeDecodeError as e:
                                         raise UnpackParserException(e.args) from e
 
@@ -382,6 +425,7 @@ class ElfUnpackParser(UnpackParser):
         # span multiple sections.
         for header in self.data.header.section_headers:
             if header.type == elf.Elf.ShType.progbits:
+                section_name = header.name
                 interesting = False
 
                 # * .gnu_debugdata: XZ compressed debugging information
@@ -390,29 +434,29 @@ class ElfUnpackParser(UnpackParser):
                 # * .BTF and .BTF.ext: eBPF related files
                 # * .rom_info: Mediatek preloader(?)
                 # * .init.data: Linux kernel init data, sometimes contains initial ramdisk
-                if header.name in ['.gnu_debugdata', '.qtmimedatabase', '.BTF', '.BTF.ext',
-                                   '.rom_info', '.init.data', 'esstra_info']:
+                if section_name in ['.gnu_debugdata', '.qtmimedatabase', '.BTF', '.BTF.ext',
+                                    '.rom_info', '.init.data', 'esstra_info']:
                     interesting = True
 
                 # GNOME/glib GVariant database
-                if header.name.startswith('.gresource'):
+                if section_name.startswith('.gresource'):
                     interesting = True
 
                 # GNU zdebug
-                if header.name.startswith('.zdebug'):
+                if section_name.startswith('.zdebug'):
                     interesting = True
 
                 if not interesting:
                     continue
 
-                file_path = pathlib.Path(header.name)
+                file_path = pathlib.Path(section_name)
                 with meta_directory.unpack_regular_file(file_path) as (unpacked_md, outfile):
-                    outfile.write(header.body)
+                    outfile.write(header.raw_body)
 
                     parent_name = pathlib.Path(self.infile.name)
                     # for some files some extra information should be
                     # passed to the downstream unpackers
-                    if header.name == '.gnu_debugdata':
+                    if section_name == '.gnu_debugdata':
                         # MiniDebugInfo files:
                         # https://sourceware.org/gdb/onlinedocs/gdb/MiniDebugInfo.html
                         parent_name = pathlib.Path(self.infile.name)
@@ -420,19 +464,19 @@ class ElfUnpackParser(UnpackParser):
                             unpacked_md.info['propagated'] = {'parent': parent_name}
                             unpacked_md.info['propagated']['name'] = f'{parent_name.name}.debug'
                             unpacked_md.info['propagated']['type'] = 'MiniDebugInfo'
-                    elif header.name == '.qtmimedatabase':
+                    elif section_name == '.qtmimedatabase':
                         # Qt MIME database
                         with unpacked_md.open(open_file=False):
                             unpacked_md.info['propagated'] = {'parent': parent_name}
                             unpacked_md.info['propagated']['name'] = 'freedesktop.org.xml'
                             unpacked_md.info['propagated']['type'] = 'Qt MIME database'
-                    elif header.name == '.BTF':
+                    elif section_name == '.BTF':
                         with unpacked_md.open(open_file=False):
                             unpacked_md.info['suggested_parsers'] = ['btf']
-                    elif header.name == '.BTF.ext':
+                    elif section_name == '.BTF.ext':
                         with unpacked_md.open(open_file=False):
                             unpacked_md.info['suggested_parsers'] = ['btf_ext']
-                    elif header.name.startswith('.zdebug'):
+                    elif section_name.startswith('.zdebug'):
                         with unpacked_md.open(open_file=False):
                             unpacked_md.info['suggested_parsers'] = ['zdebug']
                     yield unpacked_md
@@ -442,33 +486,18 @@ class ElfUnpackParser(UnpackParser):
         self.metadata = {}
 
         # generic bits first
-        if self.data.bits == elf.Elf.Bits.b32:
-            self.metadata['bits'] = 32
-        elif self.data.bits == elf.Elf.Bits.b64:
-            self.metadata['bits'] = 64
+        if self.data.bits in ELF_BITS:
+            self.metadata['bits'] = ELF_BITS[self.data.bits]
 
-        # store the endianness
-        if self.data.endian == elf.Elf.Endian.le:
-            self.metadata['endian'] = 'little'
-        elif self.data.endian == elf.Elf.Endian.be:
-            self.metadata['endian'] = 'big'
+        # store the endianness. Parsing already failed
+        # if the endianness could not be determined.
+        self.metadata['endian'] = ELF_ENDIAN[self.data.endian]
 
         # store the ELF version
         self.metadata['version'] = self.data.ei_version
 
         # store the type of ELF file
-        if self.data.header.e_type == elf.Elf.ObjType.no_file_type:
-            self.metadata['type'] = None
-        elif self.data.header.e_type == elf.Elf.ObjType.relocatable:
-            self.metadata['type'] = 'relocatable'
-        elif self.data.header.e_type == elf.Elf.ObjType.executable:
-            self.metadata['type'] = 'executable'
-        elif self.data.header.e_type == elf.Elf.ObjType.shared:
-            self.metadata['type'] = 'shared'
-        elif self.data.header.e_type == elf.Elf.ObjType.core:
-            self.metadata['type'] = 'core'
-        else:
-            self.metadata['type'] = 'processor specific'
+        self.metadata['type'] = ELF_TYPES.get(self.data.header.e_type, 'processor specific')
 
         # store the machine type, both numerical and pretty printed
         if isinstance(self.data.header.machine, int):
@@ -511,7 +540,7 @@ class ElfUnpackParser(UnpackParser):
 
         self.metadata['security'] = sorted(self.security_metadata)
 
-        elf_types = set(self.metadata.get('elf_type', []))
+        elf_types = self.metadata.get('elf_type', set())
         if self.is_dynamic_elf:
             elf_types.add('dynamic')
         else:
@@ -523,14 +552,20 @@ class ElfUnpackParser(UnpackParser):
         self.metadata['elf_type'] = sorted(elf_types)
 
         if self.metadata['type'] in ['executable', 'shared']:
-            try:
-                telfhash_result = telfhash.telfhash(str(to_meta_directory.file_path))
-                if telfhash_result != []:
-                    telfhash_res = telfhash_result[0]['telfhash'].upper()
-                    if telfhash_res not in ['TNULL', '-']:
-                        self.metadata['telfhash'] = telfhash_res
-            except UnicodeEncodeError:
-                pass
+            # telfhash parses the file again, so reuse the result if a
+            # file with the same contents has been seen before.
+            sha256 = to_meta_directory.info.get('metadata', {}).get('hashes', {}).get('sha256')
+            if sha256 is not None and sha256 in TELFHASH_CACHE:
+                telfhash_res = TELFHASH_CACHE[sha256]
+            else:
+                telfhash_res = compute_telfhash(to_meta_directory.file_path)
+                if sha256 is not None:
+                    if len(TELFHASH_CACHE) >= TELFHASH_CACHE_SIZE:
+                        # dictionaries keep the insertion order
+                        del TELFHASH_CACHE[next(iter(TELFHASH_CACHE))]
+                    TELFHASH_CACHE[sha256] = telfhash_res
+            if telfhash_res is not None:
+                self.metadata['telfhash'] = telfhash_res
 
         super().write_info(to_meta_directory)
 
@@ -543,8 +578,10 @@ class ElfUnpackParser(UnpackParser):
         if self.data.header.section_names is not None:
             metadata['section_names'] = sorted(self.data.header.section_names.entries)
 
-        # store the data normally extracted using for example 'strings'
-        data_strings = []
+        # store the data normally extracted using for example 'strings'.
+        # Read-only data often contains the same string many times, so
+        # use a dict to store every string only once, in the original order.
+        data_strings = {}
 
         # store dependencies (empty for statically linked binaries)
         needed = []
@@ -568,82 +605,75 @@ class ElfUnpackParser(UnpackParser):
 
         # process the various section headers
         sections = {}
-        section_ctr = 0
         elf_types = set()
-        for header in self.data.header.section_headers:
-            sections[header.name] = {}
-            sections[header.name]['nr'] = section_ctr
-            sections[header.name]['address'] = header.addr
+        for section_ctr, header in enumerate(self.data.header.section_headers):
+            # the type and name are used a lot, so only look them up once
+            section_type = header.type
+            section_name = header.name
 
-            if isinstance(header.type, int):
-                sections[header.name]['type'] = header.type
-            else:
-                sections[header.name]['type'] = header.type.name
-
-            if header.type != elf.Elf.ShType.nobits:
-                sections[header.name]['size'] = header.len_body
-                sections[header.name]['offset'] = header.ofs_body
-                if header.body != b'':
-                    sections[header.name]['hashes'] = {}
-                    for hash_algorithm in HASH_ALGORITHMS:
-                        section_hash = hashlib.new(hash_algorithm)
-                        section_hash.update(header.raw_body)
-                        sections[header.name]['hashes'][hash_algorithm] = section_hash.hexdigest()
+            # build the information for a section in a local
+            # dict and only store it when it is complete
+            section = {'nr': section_ctr, 'address': header.addr}
 
-                    try:
-                        tlsh_hash = tlsh.hash(header.raw_body)
+            if isinstance(section_type, int):
+                section['type'] = section_type
+            else:
+                section['type'] = section_type.name
+
+            if section_type != elf.Elf.ShType.nobits:
+                section['size'] = header.len_body
+                section['offset'] = header.ofs_body
+                # check the size instead of the body, as getting the body
+                # parses sections like relocations, which are not used.
+                if header.len_body != 0:
+                    # get the section data once and feed the same buffer
+                    # to all the hashes. The hashes are only used for
+                    # identification, not for any security purposes.
+                    section_data = header.raw_body
+                    section_hashes = {hash_algorithm: hashlib.new(hash_algorithm, section_data,
+                                                                  usedforsecurity=False).hexdigest()
+                                      for hash_algorithm in HASH_ALGORITHMS}
+
+                    # TLSH needs a minimum amount of data, shorter
+                    # sections only result in 'TNULL'
+                    if header.len_body >= TLSH_MINIMUM:
+                        tlsh_hash = tlsh.hash(section_data)
                         if tlsh_hash != 'TNULL':
-                            sections[header.name]['hashes']['tlsh'] = tlsh_hash
-                    except:
-                        pass
+                            section_hashes['tlsh'] = tlsh_hash
+                    section['hashes'] = section_hashes
 
-            section_ctr += 1
+            sections[section_name] = section
 
-            if header.name in ['.modinfo', '__ksymtab_strings']:
+            if section_name in ['.modinfo', '__ksymtab_strings']:
                 # TODO: find example where this data is only in __ksymtab_strings
                 elf_types.add('Linux kernel module')
                 try:
-                    module_meta = header.body.split(b'\x00')
-                    for m in module_meta:
-                        meta = m.decode()
-                        if meta == '':
-                            continue
-                        if meta.startswith('name='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            linux_kernel_module_info['name'] = self.module_name
-                        elif meta.startswith('license='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            linux_kernel_module_info['license'] = self.module_name
-                        elif meta.startswith('author='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            linux_kernel_module_info['author'] = self.module_name
-                        elif meta.startswith('description='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            linux_kernel_module_info['description'] = self.module_name
-                        elif meta.startswith('vermagic='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            linux_kernel_module_info['vermagic'] = self.module_name
-                        elif meta.startswith('depends='):
-                            self.module_name = meta.split('=', maxsplit=1)[1]
-                            if self.module_name != '':
-                                if 'depends' not in linux_kernel_module_info:
-                                    linux_kernel_module_info['depends'] = []
-                                linux_kernel_module_info['depends'].append(self.module_name)
+                    for res in RE_MODINFO.finditer(header.raw_body):
+                        key = res.group(1).decode()
+                        value = res.group(2).decode()
+                        if key == 'depends':
+                            if value != '':
+                                linux_kernel_module_info.setdefault('depends', []).append(value)
+                        else:
+                            if key == 'name':
+                                self.module_name = value
+                            linux_kernel_module_info[key] = value
                 except Exception:
                     pass
-            elif header.name in ['.oat_patches', '.text.oat_patches', '.dex']:
+            elif section_name in ['.oat_patches', '.text.oat_patches', '.dex']:
                 # OAT information has been stored in various sections
                 # test files:
                 # .oat_patches : fugu-lrx21m-factory-e012394c.zip
                 elf_types.add('oat')
                 elf_types.add('android')
-            elif header.name in ['.guile.procprops', '.guile.frame-maps',
-                                 '.guile.arities.strtab', '.guile.arities',
-                                 '.guile.docstrs.strtab', '.guile.docstrs']:
+            elif section_name in ['.guile.procprops', '.guile.frame-maps',
+                                  '.guile.arities.strtab', '.guile.arities',
+                                  '.guile.docstrs.strtab', '.guile.docstrs']:
                 elf_types.add('guile')
 
-            if header.type == elf.Elf.ShType.dynamic:
-                if header.name == '.dynamic':
+            if section_type == elf.Elf.ShType.dynamic:
+                self.is_dynamic_elf = True
+                if section_name == '.dynamic':
                     for entry in header.body.entries:
                         if entry.tag_enum == elf.Elf.DynamicArrayTags.needed:
                             needed.append({'name': entry.value_str, 'symbol_versions': self.dependencies_to_versions.get(entry.value_str, [])})
@@ -670,34 +700,26 @@ class ElfUnpackParser(UnpackParser):
                                     self.security_metadata.add('full relro')
                                 else:
                                     self.security_metadata.add('partial relro')
-            elif header.type == elf.Elf.ShType.symtab:
-                if header.name == '.symtab':
-                    for idx, entry in enumerate(header.body.entries):
-                        symbol = {}
-                        if entry.name is None:
-                            symbol['name'] = ''
-                        else:
-                            symbol['name'] = entry.name
-                        symbol['type'] = entry.type.name
-                        symbol['binding'] = entry.bind.name
-                        symbol['visibility'] = entry.visibility.name
-                        symbol['section_index'] = entry.sh_idx
-                        symbol['size'] = entry.size
-                        symbols.append(symbol)
-            elif header.type == elf.Elf.ShType.dynsym:
-                if header.name == '.dynsym':
+            elif section_type == elf.Elf.ShType.symtab:
+                if section_name == '.symtab':
+                    for entry in header.body.entries:
+                        symbol_name = entry.name
+                        if symbol_name is None:
+                            symbol_name = ''
+                        symbols.append({'name': symbol_name, 'type': entry.type.name,
+                                        'binding': entry.bind.name,
+                                        'visibility': entry.visibility.name,
+                                        'section_index': entry.sh_idx, 'size': entry.size})
+            elif section_type == elf.Elf.ShType.dynsym:
+                if section_name == '.dynsym':
                     for idx, entry in enumerate(header.body.entries):
-                        symbol = {}
-                        if entry.name is None:
-                            symbol['name'] = ''
-                        else:
-                            symbol['name'] = entry.name
-                        symbol['binding'] = entry.bind.name
-                        symbol['section_index'] = entry.sh_idx
-                        symbol['size'] = entry.size
-                        symbol['type'] = entry.type.name
-                        symbol['value'] = entry.value
-                        symbol['visibility'] = entry.visibility.name
+                        symbol_name = entry.name
+                        if symbol_name is None:
+                            symbol_name = ''
+                        symbol = {'name': symbol_name, 'binding': entry.bind.name,
+                                  'section_index': entry.sh_idx, 'size': entry.size,
+                                  'type': entry.type.name, 'value': entry.value,
+                                  'visibility': entry.visibility.name}
 
                         # add versioning information, if any
                         if self.symbol_to_version != {}:
@@ -709,22 +731,19 @@ class ElfUnpackParser(UnpackParser):
                         symbols.append(symbol)
                         dynamic_symbols.append(symbol)
 
-                        if symbol['name'] == 'oatdata':
+                        if symbol_name == 'oatdata':
                             elf_types.add('oat')
                             elf_types.add('android')
 
-                        if symbol['name'] in OCAML_NAMES:
+                        if symbol_name in OCAML_NAMES:
                             elf_types.add('ocaml')
 
                         # security related information
-                        if symbol['name'] == '__stack_chk_fail':
+                        if symbol_name == '__stack_chk_fail':
                             self.security_metadata.add('stack smashing protector')
-                        if '_chk' in symbol['name']:
-                            if 'fortify' not in self.security_metadata:
-                                for fortify_name in FORTIFY_NAMES:
-                                    if symbol['name'].endswith(fortify_name):
-                                        self.security_metadata.add('fortify')
-                                        break
+                        if '_chk' in symbol_name and 'fortify' not in self.security_metadata:
+                            if symbol_name.endswith(FORTIFY_NAMES):
+                                self.security_metadata.add('fortify')
 
                         # try to link symbols to actual strings
                         if self.elf is not None:
@@ -742,16 +761,18 @@ class ElfUnpackParser(UnpackParser):
                                 except (pwnlib.exception.PwnlibException, UnicodeDecodeError, KeyError):
                                     pass
 
-            elif header.type == elf.Elf.ShType.progbits:
-                # process the various progbits sections here
-                if header.name == '.comment':
+            elif section_type == elf.Elf.ShType.progbits:
+                # process the various progbits sections here. The body
+                # of progbits sections is not parsed by kaitai, so use
+                # the raw body, which has already been read for hashing.
+                if section_name == '.comment':
                     # comment, typically in binaries that have
                     # not been stripped.
                     #
                     # The "strings" flag *should* be set for this section
                     # There could be multiple valid comments separated by \x00
                     # for example in some Android binaries
-                    comment_components = list(filter(lambda x: x != b'', header.body.split(b'\x00')))
+                    comment_components = list(filter(lambda x: x != b'', header.raw_body.split(b'\x00')))
                     comments = []
                     for cc in comment_components:
                         try:
@@ -761,36 +782,42 @@ class ElfUnpackParser(UnpackParser):
                             pass
                     if comments:
                         metadata['comment'] = comments
-                elif header.name == '.gcc_except_table':
+                elif section_name == '.gcc_except_table':
                     # debug information from GCC
                     pass
-                elif header.name == '.gnu_debuglink':
+                elif section_name == '.gnu_debuglink':
                     # https://sourceware.org/gdb/onlinedocs/gdb/Separate-Debug-Files.html
                     try:
-                        link_name = header.body.split(b'\x00', 1)[0].decode()
-                        link_crc = int.from_bytes(header.body[-4:], byteorder=endian)
+                        link_name = header.raw_body.split(b'\x00', 1)[0].decode()
+                        link_crc = int.from_bytes(header.raw_body[-4:], byteorder=endian)
                         metadata['gnu debuglink'] = link_name
                         metadata['gnu debuglink crc'] = link_crc
                     except UnicodeDecodeError:
                         pass
-                elif header.name == '.GCC.command.line':
+                elif section_name == '.GCC.command.line':
                     # GCC -frecord-gcc-switches option
                     gcc_command_line_strings = []
-                    for s in header.body.split(b'\x00'):
+                    for s in header.raw_body.split(b'\x00'):
                         try:
                             gcc_command_line_strings.append(s.decode())
                         except UnicodeDecodeError:
                             pass
                     if gcc_command_line_strings:
                         metadata['.GCC.command.line'] = gcc_command_line_strings
-                elif header.name in RODATA_SECTIONS:
-                    for s in header.body.split(b'\x00'):
+                elif section_name in RODATA_SECTIONS:
+                    for s in header.raw_body.split(b'\x00'):
+                        # a decoded string is never longer than its bytes,
+                        # so short byte strings (the majority) can be
+                        # skipped without decoding them.
+                        if len(s) < string_cutoff_length:
+                            continue
                         try:
                             decoded_strings = s.decode().splitlines()
                             for decoded_string in decoded_strings:
-                                for rc in REMOVE_CHARACTERS:
-                                    if rc in decoded_string:
-                                        decoded_string = decoded_string.translate(REMOVE_CHARACTERS_TABLE)
+                                # all the characters to be removed are not
+                                # printable, so most strings can be skipped.
+                                if not decoded_string.isprintable():
+                                    decoded_string = decoded_string.translate(REMOVE_CHARACTERS_TABLE)
 
                                 if len(decoded_string) < string_cutoff_length:
                                     continue
@@ -801,194 +828,179 @@ class ElfUnpackParser(UnpackParser):
                                 if decoded_string.isascii():
                                     # test the translated string
                                     if translated_string.isprintable():
-                                        data_strings.append(decoded_string)
+                                        data_strings[decoded_string] = None
                                 else:
-                                    data_strings.append(decoded_string)
+                                    data_strings[decoded_string] = None
                         except UnicodeDecodeError:
                             pass
                     # some Qt binaries use the Qt resource system,
                     # containing images, text, etc.
                     # Sometimes these end up in one of the .rodata ELF sections.
-                    if b'qrc:/' in header.body:
+                    if b'qrc:/' in header.raw_body:
                         pass
-                elif header.name == '.interp':
+                elif section_name == '.interp':
                     # store the location of the dynamic linker
                     try:
-                        metadata['linker'] = header.body.split(b'\x00', 1)[0].decode()
+                        metadata['linker'] = header.raw_body.split(b'\x00', 1)[0].decode()
                     except UnicodeDecodeError:
                         pass
 
                 # Some Go related things
-                elif header.name == '.gopclntab':
+                elif section_name == '.gopclntab':
                     # https://medium.com/walmartglobaltech/de-ofuscating-golang-functions-93f610f4fb76
                     pass
-                elif header.name == '.gosymtab':
+                elif section_name == '.gosymtab':
                     # Go symbol table
                     pass
-                elif header.name == '.itablink':
+                elif section_name == '.itablink':
                     # Go
                     pass
-                elif header.name == '.noptrdata':
+                elif section_name == '.noptrdata':
                     # Go pointer free data
                     pass
-                elif header.name == '.typelink':
+                elif section_name == '.typelink':
                     # Go
                     pass
 
                 # QML and Qt
-                elif header.name == '.qml_compile_hash':
+                elif section_name == '.qml_compile_hash':
                     pass
-                elif header.name == '.qtmetadata':
+                elif section_name == '.qtmetadata':
                     pass
-                elif header.name == '.qtversion':
+                elif section_name == '.qtversion':
                     pass
 
-                elif header.name == '.tm_clone_table':
+                elif section_name == '.tm_clone_table':
                     # something related to transactional memory
                     # http://gcc.gnu.org/wiki/TransactionalMemory
                     pass
-                elif header.name == '.VTGData':
+                elif section_name == '.VTGData':
                     # VirtualBox tracepoint generated data
                     # https://www.virtualbox.org/browser/vbox/trunk/include/VBox/VBoxTpG.h
                     pass
-                elif header.name == '.VTGPrLc':
+                elif section_name == '.VTGPrLc':
                     pass
-                elif header.name == '.rol4re_elf_aux':
+                elif section_name == '.rol4re_elf_aux':
                     # L4 specific
                     elf_types.add('l4')
-                elif header.name == '.sbat':
+                elif section_name == '.sbat':
                     # systemd, example linuxx64.elf.stub
                     # https://github.com/rhboot/shim/blob/main/SBAT.md
                     pass
-                elif header.name == '.sdmagic':
+                elif section_name == '.sdmagic':
                     # systemd, example linuxx64.elf.stub
                     try:
-                        metadata['systemd loader'] = header.body.decode()
+                        metadata['systemd loader'] = header.raw_body.decode()
                     except UnicodeDecodeError:
                         pass
-                elif header.name == 'sw_isr_table':
+                elif section_name == 'sw_isr_table':
                     # Zephyr
                     elf_types.add('zephyr')
-                elif header.name == 'protodesc_cold':
+                elif section_name == 'protodesc_cold':
                     # Protobuf
                     # example /lib64/libcompizconfig.so.0.0.0
                     elf_types.add('protobuf')
-
-            if header.type == elf.Elf.ShType.dynamic:
-                self.is_dynamic_elf = True
-                for entry in header.body.entries:
-                    pass
-            elif header.type == elf.Elf.ShType.strtab:
-                if header.name in GUILE_STRTAB_SECTIONS:
-                    for entry in header.body.entries:
-                        pass
-                else:
-                    for entry in header.body.entries:
-                        pass
-            elif header.type == elf.Elf.ShType.dynsym:
-                for entry in header.body.entries:
-                    pass
-            elif header.type == elf.Elf.ShType.note:
+            elif section_type == elf.Elf.ShType.note:
                 # Note sections can contain hints as to what is contained
                 # in a binary or give information about the origin of the
                 # binary, or the programming language.
-                if header.name == '.note.go.buildid':
+                if section_name == '.note.go.buildid':
                     elf_types.add('go')
 
                 # Although not common notes sections can be merged
                 # with eachother. Example: .notes in Linux kernel images
                 for entry in header.body.entries:
-                    notes.append((entry.name.decode(), entry.type))
-                    if entry.name == b'GNU' and entry.type == 1:
-                        # https://raw.githubusercontent.com/wiki/hjl-tools/linux-abi/linux-abi-draft.pdf
-                        # normally in .note.ABI.tag
-                        major_version = int.from_bytes(entry.descriptor[4:8],
-                                                       byteorder=endian)
-                        patchlevel = int.from_bytes(entry.descriptor[8:12],
-                                                    byteorder=endian)
-                        sublevel = int.from_bytes(entry.descriptor[12:],
-                                                  byteorder=endian)
-                        metadata['linux_version'] = (major_version, patchlevel, sublevel)
-                    elif entry.name == b'GNU' and entry.type == 3:
-                        # normally in .note.gnu.build-id
-                        # https://access.redhat.com/documentation/en-us/red_hat_enterprise_linux/6/html/developer_guide/compiling-build-id
-                        buildid = binascii.hexlify(entry.descriptor).decode()
-                        metadata['build-id'] = buildid
-                        if len(buildid) == 40:
-                            metadata['build-id hash'] = 'sha1'
-                        elif len(buildid) == 32:
-                            metadata['build-id hash'] = 'md5'
-                    elif entry.name == b'GNU' and entry.type == 4:
-                        # normally in .note.gnu.gold-version
-                        try:
-                            metadata['gold-version'] = entry.descriptor.split(b'\x00', 1)[0].decode()
-                        except UnicodeDecodeError:
+                    # keep name and type in locals, as they are
+                    # compared many times in the checks below.
+                    note_name = entry.name
+                    note_type = entry.type
+                    notes.append((note_name.decode(), note_type))
+
+                    # GNU notes are by far the most common, so check
+                    # for those first.
+                    if note_name == b'GNU':
+                        if note_type == 1:
+                            # https://raw.githubusercontent.com/wiki/hjl-tools/linux-abi/linux-abi-draft.pdf
+                            # normally in .note.ABI.tag
+                            if len(entry.descriptor) >= 16:
+                                metadata['linux_version'] = ABI_TAG_VERSION[endian].unpack_from(entry.descriptor, 4)
+                        elif note_type == 3:
+                            # normally in .note.gnu.build-id
+                            # https://access.redhat.com/documentation/en-us/red_hat_enterprise_linux/6/html/developer_guide/compiling-build-id
+                            buildid = binascii.hexlify(entry.descriptor).decode()
+                            metadata['build-id'] = buildid
+                            if len(buildid) == 40:
+                                metadata['build-id hash'] = 'sha1'
+                            elif len(buildid) == 32:
+                                metadata['build-id hash'] = 'md5'
+                        elif note_type == 4:
+                            # normally in .note.gnu.gold-version
+                            try:
+                                metadata['gold-version'] = entry.descriptor.split(b'\x00', 1)[0].decode()
+                            except UnicodeDecodeError:
+                                pass
+                        elif note_type == 5:
+                            # normally in .note.gnu.property
                             pass
-                    elif entry.name == b'GNU' and entry.type == 5:
-                        # normally in .note.gnu.property
-                        pass
-                    elif entry.name == b'Go' and entry.type == 4:
+                    elif note_name == b'Go' and note_type == 4:
                         # normally in .note.go.buildid
                         # there are four hashes concatenated
                         # https://golang.org/pkg/cmd/internal/buildid/#FindAndHash
                         # http://web.archive.org/web/20210113145647/https://utcc.utoronto.ca/~cks/space/blog/programming/GoBinaryStructureNotes
                         pass
-                    elif entry.name == b'Crashpad' and entry.type == 0x4f464e49:
+                    elif note_name in NOTE_ELF_TYPES:
+                        # notes where only the name is used
+                        elf_types.add(NOTE_ELF_TYPES[note_name])
+                    elif note_name == b'Crashpad' and note_type == 0x4f464e49:
                         # https://chromium.googlesource.com/crashpad/crashpad/+/refs/heads/master/util/misc/elf_note_types.h
                         pass
-                    elif entry.name == b'stapsdt' and entry.type == 3:
+                    elif note_name == b'stapsdt' and note_type == 3:
                         # SystemTap probe descriptors
                         elf_types.add('SystemTap')
-                    elif entry.name == b'Linux':
+                    elif note_name == b'Linux':
                         # .note.Linux as seen in some Linux kernel modules
                         elf_types.add('linux kernel')
-                        if entry.type == 0x100:
+                        if note_type == 0x100:
                             # LINUX_ELFNOTE_BUILD_SALT
                             # see BUILD_SALT in init/Kconfig
+                            # The salt is a NUL terminated string that is
+                            # padded with NUL characters, so remove these
+                            # before decoding.
                             try:
-                                linux_kernel_module_info['kernel build id salt'] = entry.descriptor.decode()
+                                linux_kernel_module_info['kernel build id salt'] = entry.descriptor.rstrip(b'\x00').decode()
                             except UnicodeDecodeError:
                                 pass
-                        elif entry.type == 0x101:
+                        elif note_type == 0x101:
                             # LINUX_ELFNOTE_LTO_INFO
                             pass
-                    elif entry.name == b'FDO':
-                        if entry.type == 0xcafe1a7e:
+                    elif note_name == b'FDO':
+                        if note_type == 0xcafe1a7e:
                             # https://fedoraproject.org/wiki/Changes/Package_information_on_ELF_objects
                             # https://systemd.io/COREDUMP_PACKAGE_METADATA/
-                            # extract JSON and store it
+                            # extract JSON and store it. json.loads() can
+                            # process the bytes directly.
                             try:
-                                metadata['package note'] = json.loads(entry.descriptor.decode().split('\x00')[0].strip())
+                                metadata['package note'] = json.loads(entry.descriptor.split(b'\x00', 1)[0].strip())
                             except:
                                 pass
-                        elif entry.type == 0x407c0c0a:
+                        elif note_type == 0x407c0c0a:
                             # https://systemd.io/ELF_DLOPEN_METADATA/
                             try:
-                                metadata['dlopen note'] = json.loads(entry.descriptor.decode().split('\x00')[0].strip())
+                                metadata['dlopen note'] = json.loads(entry.descriptor.split(b'\x00', 1)[0].strip())
                             except:
                                 pass
-                    elif entry.name == b'FreeBSD':
-                        elf_types.add('freebsd')
-                    elif entry.name == b'OpenBSD':
-                        elf_types.add('openbsd')
-                    elif entry.name == b'NetBSD':
-                        # https://www.netbsd.org/docs/kernel/elf-notes.html
-                        elf_types.add('netbsd')
-                    elif entry.name == b'Android' and entry.type == 1:
-                        # https://android.googlesource.com/platform/ndk/+/master/parse_elfnote.py
-                        elf_types.add('android')
-                        metadata['android ndk'] = int.from_bytes(entry.descriptor, byteorder='little')
-                    elif entry.name == b'Android' and entry.type == 4:
-                        # .note.android.memtag
-                        elf_types.add('android')
-                    elif entry.name == b'Xen':
-                        # http://xenbits.xen.org/gitweb/?p=xen.git;a=blob;f=xen/include/public/elfnote.h;h=181cbc4ec71c4af298e40c3604daff7d3b48d52f;hb=HEAD
-                        # .note.Xen in FreeBSD kernel
-                        # .notes in Linux kernel)
-                        elf_types.add('xen')
-                    elif entry.name == b'NaCl':
-                        elf_types.add('Google Native Client')
-                    elif entry.name == b'LLVM\x00\x00\x00\x00' and entry.type == 3:
+                    elif note_name == b'Android':
+                        if note_type == 1:
+                            # https://android.googlesource.com/platform/ndk/+/master/parse_elfnote.py
+                            elf_types.add('android')
+                            # the descriptor starts with the API level. Newer
+                            # NDKs add the NDK version and build number after it.
+                            if len(entry.descriptor) >= 4:
+                                metadata['android ndk'] = ANDROID_API_LEVEL.unpack_from(entry.descriptor)[0]
+                        elif note_type == 4:
+                            # .note.android.memtag
+                            elf_types.add('android')
+                    elif note_name == b'LLVM\x00\x00\x00\x00' and note_type == 3:
                         # .notes.hwasan.globals
                         # https://source.android.com/docs/security/test/memory-safety/hwasan-reports
                         # https://reviews.llvm.org/D65770
@@ -1006,7 +1018,7 @@ class ElfUnpackParser(UnpackParser):
         metadata['notes'] = notes
 
         if data_strings:
-            metadata['strings'] = data_strings
+            metadata['strings'] = list(data_strings)
 
         if symbols:
             metadata['symbols'] = symbols
@@ -1016,7 +1028,8 @@ class ElfUnpackParser(UnpackParser):
         if linux_kernel_module_info:
             metadata['Linux kernel module'] = linux_kernel_module_info
 
-        metadata['elf_type'] = sorted(elf_types)
+        # this is sorted in write_info(), after more types have been added
+        metadata['elf_type'] = elf_types
         return metadata
 
 
@@ -18,13 +18,53 @@
 # Copyright Armijn Hemel
 # SPDX-License-Identifier: GPL-3.0-only
 
+import errno
 import os
 import uuid
 import pathlib
+
+from kaitaistruct import ValidationFailedError
+
 from bang.UnpackParser import UnpackParser, check_condition
 from bang.UnpackParserException import UnpackParserException
 from . import gpt_partition_table
 
+# partition type GUID of unused partition entries
+UNUSED_PARTITION_TYPE = b'\x00' * 16
+
+# errors for which copy_file_range() should be replaced by sendfile()
+COPY_FILE_RANGE_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL)
+
+
+def copy_partition(out_fd, in_fd, offset, length):
+    '''Copy length bytes starting at offset in in_fd to out_fd.
+    copy_file_range() is tried first, as file systems like btrfs and XFS
+    can then share the data with the input file instead of copying it.
+    If it is not supported, fall back to sendfile().'''
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+
+    # Both calls can write less data than requested, for example
+    # they will not write more than 2147479552 bytes at once, so
+    # keep copying until everything has been written.
+    # Reference: https://bugzilla.redhat.com/show_bug.cgi?id=612839
+    while length > 0:
+        if use_copy_file_range:
+            try:
+                bytes_written = os.copy_file_range(in_fd, out_fd, length, offset)
+            except OSError as e:
+                if e.errno not in COPY_FILE_RANGE_ERRORS:
+                    raise
+                use_copy_file_range = False
+                continue
+        else:
+            bytes_written = os.sendfile(out_fd, in_fd, offset, length)
+        if bytes_written == 0:
+            # end of the input file
+            break
+        length -= bytes_written
+        offset += bytes_written
+
+
 class GptPartitionTableUnpackParser(UnpackParser):
     pretty_name = 'gpt'
     signatures = [
@@ -33,10 +73,20 @@ class GptPartitionTableUnpackParser(UnpackParser):
     def parse(self):
         try:
             self.data = gpt_partition_table.GptPartitionTable.from_io(self.infile)
+
+            # compute the boundaries of all partitions while
+            # parsing, so unpack() does not have to recompute them.
+            sector_size = self.data.sector_size
+            self.partitions = []
             for e in self.data.primary.entries:
-                partition_start = e.first_lba * self.data.sector_size
-                partition_end = (e.last_lba + 1) * self.data.sector_size
-        except BaseException as e:
+                # unused entries have an all zero partition type GUID.
+                # Most GPTs have room for 128 entries, but only use a few.
+                if e.type_guid == UNUSED_PARTITION_TYPE:
+                    continue
+                partition_start = e.first_lba * sector_size
+                partition_end = (e.last_lba + 1) * sector_size
+                self.partitions.append((partition_start, partition_end))
+        except (Exception, ValidationFailedError) as e:
             raise UnpackParserException(e.args) from e
 
     def calculate_unpacked_size(self):
@@ -55,31 +105,25 @@ class GptPartitionTableUnpackParser(UnpackParser):
         # TODO: better exception handling
         try:
             self.unpacked_size = (self.data.primary.backup_lba+1)*self.data.sector_size
-        except BaseException as e:
+        except (Exception, ValidationFailedError) as e:
             raise UnpackParserException(e.args) from e
 
         all_entries_size = self.data.primary.entries_size * self.data.primary.entries_count
         self.unpacked_size = max(self.unpacked_size, self.data.primary.entries_start * self.data.sector_size + all_entries_size)
-        for e in self.data.primary.entries:
-            partition_start = e.first_lba * self.data.sector_size
-            partition_end = (e.last_lba + 1) * self.data.sector_size
-            if partition_start  + partition_end > self.infile.size:
-                continue
         check_condition(self.unpacked_size <= self.infile.size,
                 "partition bigger than file")
 
     def unpack(self, meta_directory):
         partition_number = 0
-        for e in self.data.primary.entries:
-            partition_start = e.first_lba * self.data.sector_size
+        for partition_start, partition_end in self.partitions:
             if partition_start > self.infile.size:
                 continue
-            partition_end = (e.last_lba + 1) * self.data.sector_size
             partition_ext = 'part'
 
             outfile = f"unpacked.gpt-partition{partition_number,}.{partition_ext}"
             with meta_directory.unpack_regular_file(pathlib.Path(outfile)) as (unpacked_md, f):
-                os.sendfile(f.fileno(), self.infile.fileno(), partition_start, partition_end - partition_start)
+                copy_partition(f.fileno(), self.infile.fileno(), self.offset + partition_start,
+                               partition_end - partition_start)
                 with unpacked_md.open(open_file=False):
                     unpacked_md.info.setdefault('labels', []).append('partition')
                 yield unpacked_md
@@ -90,11 +134,12 @@ class GptPartitionTableUnpackParser(UnpackParser):
     @property
     def metadata(self):
         metadata = {}
-        metadata['partitions'] = []
 
-        # store GUID per partition
-        for e in self.data.primary.entries:
-            guid = uuid.UUID(bytes=e.guid)
-            metadata['partitions'].append({'uuid': guid, 'name': e.name.split('\x00')[0]})
+        # store GUID and name per partition, skipping unused entries
+        # like unpack() does so the partitions are in the same order.
+        # The name is padded with NUL characters.
+        metadata['partitions'] = [{'uuid': uuid.UUID(bytes=e.guid), 'name': e.name.split('\x00', 1)[0]}
+                                  for e in self.data.primary.entries
+                                  if e.type_guid != UNUSED_PARTITION_TYPE]
 
         return metadata
@@ -24,7 +24,6 @@
 # where for example UBI/UBIFS are chosen.
 
 import lzma
-import os
 import pathlib
 import zlib
 
@@ -45,6 +44,96 @@ LZMA_PB = 0
 LZMA_LP = 0
 LZMA_LC = 0
 
+# filters for the LZMA decompressor, as the data
+# is stored without LZMA headers.
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA1, 'dict_size': LZMA_DICT_SIZE,
+                 'lc': LZMA_LC, 'lp': LZMA_LP, 'pb': LZMA_PB}]
+
+# valid first two bytes of a node per endianness: the node magic,
+# a dirty node or empty space. Big endian and little endian cannot be mixed.
+VALID_NODE_MAGIC = {'little': frozenset([b'\x85\x19', b'\x00\x00', b'\xff\xff']),
+                    'big': frozenset([b'\x19\x85', b'\x00\x00', b'\xff\xff'])}
+
+# compression methods that can be decompressed
+DECOMPRESSABLE_COMPRESSION = frozenset([jffs2.Jffs2.Compression.no_compression,
+                                        jffs2.Jffs2.Compression.zlib,
+                                        jffs2.Jffs2.Compression.lzma,
+                                        jffs2.Jffs2.Compression.rtime,
+                                        jffs2.Jffs2.Compression.lzo])
+
+# errors raised when decompressing invalid data. rtime_decompress()
+# raises IndexError when it reads or writes out of bounds.
+DECOMPRESSION_ERRORS = (zlib.error, lzma.LZMAError, lzo.error, IndexError)
+
+# how many bytes to read at once when skipping empty space
+EMPTY_SPACE_READ_SIZE = 65536
+
+
+def rtime_decompress(data, decompressed_size):
+    '''Decompress rtime compressed data.
+    From: https://github.com/sviehb/jefferson/blob/master/src/jefferson/rtime.py'''
+    # First initialize the positions, set to 0
+    positions = [0] * 256
+
+    # create a bytearray, set everything to 0
+    data_out = bytearray(decompressed_size)
+
+    # create counters
+    outpos = 0
+    pos = 0
+
+    # process all the bytes
+    while outpos < decompressed_size:
+        value = data[pos]
+        data_out[outpos] = value
+        outpos += 1
+        repeat = data[pos + 1]
+        pos += 2
+
+        backoffs = positions[value]
+        positions[value] = outpos
+        if repeat:
+            if backoffs + repeat >= outpos:
+                while repeat:
+                    data_out[outpos] = data_out[backoffs]
+                    outpos += 1
+                    backoffs += 1
+                    repeat -= 1
+            else:
+                data_out[outpos : outpos + repeat] = data_out[
+                    backoffs : backoffs + repeat
+                ]
+                outpos += repeat
+    return data_out
+
+
+def decompress_node(node):
+    '''Return the (decompressed) data of a regular file node, at most
+    len_decompressed bytes. The compression of the node should be one
+    of the compressions in DECOMPRESSABLE_COMPRESSION.'''
+    decompressed_size = node.len_decompressed
+
+    # Check the compression that's used as it could be that
+    # for a file compressed and uncompressed nodes are mixed
+    # in case the node cannot be compressed efficiently
+    # and the compressed data would be larger than the
+    # original data.
+    if node.compression == jffs2.Jffs2.Compression.no_compression:
+        # the data is not compressed, so can be used immediately
+        return node.data
+    if node.compression == jffs2.Jffs2.Compression.zlib:
+        return zlib.decompress(node.data)[:decompressed_size]
+    if node.compression == jffs2.Jffs2.Compression.lzma:
+        # The data is LZMA compressed, so create a
+        # LZMA decompressor with custom filter, as the data
+        # is stored without LZMA headers. lzma.decompress()
+        # cannot be used, as it requires an end marker.
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+        return decompressor.decompress(node.data)[:decompressed_size]
+    if node.compression == jffs2.Jffs2.Compression.rtime:
+        return rtime_decompress(node.data, decompressed_size)
+    return lzo.decompress(node.data, False, decompressed_size)
+
 
 class Jffs2UnpackParser(UnpackParser):
     extensions = []
@@ -54,6 +143,21 @@ class Jffs2UnpackParser(UnpackParser):
     ]
     pretty_name = 'jffs2'
 
+    def skip_empty_space(self, offset):
+        '''Return the offset of the first 4 byte aligned group of bytes
+        at or after offset that is not empty space (erased flash, 0xff)'''
+        self.infile.seek(offset)
+        empty_bytes = 0
+        while True:
+            buf = self.infile.read(EMPTY_SPACE_READ_SIZE)
+            if buf == b'':
+                break
+            non_empty_bytes = len(buf.lstrip(b'\xff'))
+            empty_bytes += len(buf) - non_empty_bytes
+            if non_empty_bytes != 0:
+                break
+        return offset + empty_bytes - empty_bytes % 4
+
     def parse(self):
         # parse the first inode to see if it is a little endian
         # or big endian file system. The first inode is *always*
@@ -101,6 +205,8 @@ class Jffs2UnpackParser(UnpackParser):
         # system ends.
         self.infile.seek(0)
 
+        valid_node_magic = VALID_NODE_MAGIC[self.byteorder]
+
         prev_is_padding = False
         while True:
             cur_offset = self.infile.tell()
@@ -117,23 +223,20 @@ class Jffs2UnpackParser(UnpackParser):
                 break
 
             # first check if the inode magic is valid: big endian
-            # and big endian cannot be mixed.
-            if self.bigendian:
-                if buf not in [b'\x19\x85', b'\x00\x00', b'\xff\xff']:
-                    break
-            else:
-                if buf not in [b'\x85\x19', b'\x00\x00', b'\xff\xff']:
-                    break
+            # and little endian cannot be mixed.
+            if buf not in valid_node_magic:
+                break
 
             if buf == b'\x00\x00':
                 # dirty nodes
                 node_magic_type = 'dirty'
             elif buf == b'\xff\xff':
-                # empty space
-                # read the next two bytes to see if they are empty as well
-                buf = self.infile.read(2)
-                if buf != b'\xff\xff':
+                # empty space, which can be large in erased flash,
+                # so skip all of it at once.
+                next_offset = self.skip_empty_space(cur_offset)
+                if next_offset == cur_offset:
                     break
+                self.infile.seek(next_offset)
                 continue
             else:
                 node_magic_type = 'normal'
@@ -142,27 +245,27 @@ class Jffs2UnpackParser(UnpackParser):
             # the magic it isn't clear which endianness is used it needs to
             # be taken from the context
             if node_magic_type == 'dirty':
-                self.infile.seek(2, os.SEEK_CUR)
-                buf = self.infile.read(4)
-                if len(buf) != 4:
+                # read the node type and the node length in one go
+                # and only use the length.
+                buf = self.infile.read(6)
+                if len(buf) != 6:
                     break
 
-                len_inode = int.from_bytes(buf, byteorder=self.byteorder)
+                len_inode = int.from_bytes(buf[2:], byteorder=self.byteorder)
                 if len_inode == 0:
                     break
                 if cur_offset + len_inode > self.infile.size:
                     break
 
                 # skip the dirty data
-                self.infile.seek(cur_offset + len_inode)
-
-                unpackedsize = self.infile.tell()
-                if unpackedsize % 4 != 0:
-                    paddingbytes = 4 - (unpackedsize % 4)
-                    self.infile.seek(paddingbytes, os.SEEK_CUR)
-                    unpackedsize = self.infile.tell()
+                # nodes are 4 byte aligned, so also skip any padding
+                self.infile.seek((cur_offset + len_inode + 3) & ~3)
                 continue
 
+            # read the rest of the first 8 bytes of the node, which
+            # are needed for the header CRC, before parsing the node.
+            crc_bytes = buf + self.infile.read(6)
+
             # reset the file pointer and parse with Kaitai Struct
             self.infile.seek(cur_offset)
 
@@ -211,11 +314,6 @@ class Jffs2UnpackParser(UnpackParser):
             # MIT licensed script found at:
             #
             # https://github.com/sviehb/jefferson/blob/master/src/scripts/jefferson
-            stored_offset = self.infile.tell()
-            self.infile.seek(cur_offset)
-            crc_bytes = self.infile.read(8)
-            self.infile.seek(stored_offset)
-
             if jffs2_inode.header.inode_type in [jffs2.Jffs2.InodeType.dirent, jffs2.Jffs2.InodeType.inode]:
                 computedcrc = (zlib.crc32(crc_bytes, -1) ^ -1) & 0xffffffff
                 if not computedcrc == jffs2_inode.data.header_crc:
@@ -231,12 +329,8 @@ class Jffs2UnpackParser(UnpackParser):
                 if inode_number == 0:
                     # first go back to the old offset, then skip
                     # the entire inode
-                    self.infile.seek(cur_offset + jffs2_inode.header.len_inode)
-                    unpackedsize = self.infile.tell()
-                    if unpackedsize % 4 != 0:
-                        paddingbytes = 4 - (unpackedsize % 4)
-                        self.infile.seek(paddingbytes, os.SEEK_CUR)
-                        unpackedsize = self.infile.tell()
+                    # nodes are 4 byte aligned, so also skip any padding
+                    self.infile.seek((cur_offset + jffs2_inode.header.len_inode + 3) & ~3)
                     continue
 
                 # cannot have duplicate inodes
@@ -269,12 +363,8 @@ class Jffs2UnpackParser(UnpackParser):
                 if inode_number == 0:
                     # first go back to the old offset, then skip
                     # the entire inode
-                    self.infile.seek(cur_offset + jffs2_inode.header.len_inode)
-                    unpackedsize = self.infile.tell()
-                    if unpackedsize % 4 != 0:
-                        paddingbytes = 4 - (unpackedsize % 4)
-                        self.infile.seek(paddingbytes, os.SEEK_CUR)
-                        unpackedsize = self.infile.tell()
+                    # nodes are 4 byte aligned, so also skip any padding
+                    self.infile.seek((cur_offset + jffs2_inode.header.len_inode + 3) & ~3)
                     continue
 
                 filemode = jffs2_inode.data.file_mode
@@ -322,81 +412,29 @@ class Jffs2UnpackParser(UnpackParser):
                         # the data is not compressed, so can be written
                         # to the output file immediately
                         data_unpacked = True
-                    elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.zlib:
-                        # the data is zlib compressed, so first decompress
-                        # before writing
-                        try:
-                            zlib.decompress(jffs2_inode.data.body.data)
-                            data_unpacked = True
-                        except Exception:
-                            break
-                    elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.lzma:
-                        # The data is LZMA compressed, so create a
-                        # LZMA decompressor with custom filter, as the data
-                        # is stored without LZMA headers.
-                        jffs_filters = [{'id': lzma.FILTER_LZMA1,
-                                         'dict_size': LZMA_DICT_SIZE,
-                                         'lc': LZMA_LC, 'lp': LZMA_LP,
-                                         'pb': LZMA_PB}]
-
-                        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=jffs_filters)
-
-                        try:
-                            decompressor.decompress(jffs2_inode.data.body.data)
-                            data_unpacked = True
-                        except Exception:
-                            break
-                    elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.rtime:
-                        # From: https://github.com/sviehb/jefferson/blob/master/src/jefferson/rtime.py
-                        # First initialize the positions, set to 0
-                        positions = [0] * 256
-
-                        # create a bytearray, set everything to 0
-                        data_out = bytearray([0] * decompressed_size)
-
-                        # create counters
-                        outpos = 0
-                        pos = 0
-
-                        # process all the bytes
-                        while outpos < decompressed_size:
-                            value = jffs2_inode.data.body.data[pos]
-                            pos += 1
-                            data_out[outpos] = value
-                            outpos += 1
-                            repeat = jffs2_inode.data.body.data[pos]
-                            pos += 1
-
-                            backoffs = positions[value]
-                            positions[value] = outpos
-                            if repeat:
-                                if backoffs + repeat >= outpos:
-                                    while repeat:
-                                        data_out[outpos] = data_out[backoffs]
-                                        outpos += 1
-                                        backoffs += 1
-                                        repeat -= 1
-                                else:
-                                    data_out[outpos : outpos + repeat] = data_out[
-                                        backoffs : backoffs + repeat
-                                    ]
-                                    outpos += repeat
-                    elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.lzo:
-                        try:
-                            lzo.decompress(jffs2_inode.data.body.data, False, jffs2_inode.data.body.len_decompressed)
-                        except Exception as e:
-                            raise UnpackParserException("invalid lzo compressed data") from e
+                    elif jffs2_inode.data.body.compression in DECOMPRESSABLE_COMPRESSION:
+                        # The data CRC covers the compressed data, so if it
+                        # is correct the data does not need to be decompressed
+                        # here (this is done when unpacking). Otherwise fall
+                        # back to decompressing the data, as there are nodes
+                        # with an incorrect data CRC but valid data.
+                        computed_crc = (zlib.crc32(jffs2_inode.data.body.data, -1) ^ -1) & 0xffffffff
+                        if computed_crc != jffs2_inode.data.body.data_crc:
+                            try:
+                                decompress_node(jffs2_inode.data.body)
+                            except DECOMPRESSION_ERRORS:
+                                break
+                        data_unpacked = True
                     else:
                         break
 
                     # record how much data was read and use for sanity checks
                     inode_to_write_offset[inode_number] = writeoffset + decompressed_size
 
-            unpackedsize = self.infile.tell()
-            if unpackedsize % 4 != 0:
-                paddingbytes = 4 - (unpackedsize % 4)
-                self.infile.seek(paddingbytes, os.SEEK_CUR)
-                unpackedsize = self.infile.tell()
+            # nodes are 4 byte aligned, so skip any padding
+            next_offset = self.infile.tell()
+            if next_offset % 4 != 0:
+                self.infile.seek((next_offset + 3) & ~3)
 
         check_condition(data_unpacked, "no data unpacked")
         check_condition(1 in parent_inodes_seen, "no valid root file node")
@@ -414,262 +452,207 @@ class Jffs2UnpackParser(UnpackParser):
         inode_to_write_offset = {}
         current_inode = None
 
+        # the output file that is currently written to and its inode
+        outfile = None
+        outfile_inode = None
+
         # reset the file pointer to the start of the file system and read all
         # the inodes again, but now for unpacking.
         self.infile.seek(0)
 
         prev_is_padding = False
-        while True:
-            cur_offset = self.infile.tell()
-
-            # stop processing as soon as the end of the unpacked data is reached
-            if self.infile.tell() == self.unpacked_size:
-                break
-            buf = self.infile.read(2)
-            if len(buf) != 2:
-                break
 
-            if buf == b'\x00\x00':
-                # dirty nodes
-                node_magic_type = 'dirty'
-            elif buf == b'\xff\xff':
-                # empty space
-                # read the next two bytes to see if they are empty as well
-                buf = self.infile.read(2)
-                if buf != b'\xff\xff':
-                    break
-                continue
-            else:
-                node_magic_type = 'normal'
+        # The output file is kept open between nodes, so make sure
+        # it is closed when the loop ends in any way.
+        try:
+            while True:
+                cur_offset = self.infile.tell()
 
-            # skip dirty nodes. Some manual parsing is needed here. As from
-            # the magic it isn't clear which endianness is used it needs to
-            # be taken from the context
-            if node_magic_type == 'dirty':
-                self.infile.seek(2, os.SEEK_CUR)
-                buf = self.infile.read(4)
-                if len(buf) != 4:
+                # stop processing as soon as the end of the unpacked data is reached
+                if self.infile.tell() == self.unpacked_size:
                     break
-
-                len_inode = int.from_bytes(buf, byteorder=self.byteorder)
-                if cur_offset + len_inode > self.infile.size:
+                buf = self.infile.read(2)
+                if len(buf) != 2:
                     break
 
-                # skip the dirty data
-                self.infile.seek(cur_offset + len_inode)
-
-                unpackedsize = self.infile.tell()
-                if unpackedsize % 4 != 0:
-                    paddingbytes = 4 - (unpackedsize % 4)
-                    self.infile.seek(paddingbytes, os.SEEK_CUR)
-                    unpackedsize = self.infile.tell()
-                continue
-
-            # reset the file pointer and parse with Kaitai Struct
-            self.infile.seek(cur_offset)
-
-            jffs2_inode = jffs2.Jffs2.from_io(self.infile)
-
-            # check if the inode type is actually valid
-            # or perhaps contains padding.
-            if isinstance(jffs2_inode.header.inode_type, int):
-                if jffs2_inode.header.inode_type == 0:
-                    if prev_is_padding:
+                if buf == b'\x00\x00':
+                    # dirty nodes
+                    node_magic_type = 'dirty'
+                elif buf == b'\xff\xff':
+                    # empty space, which can be large in erased flash,
+                    # so skip all of it at once.
+                    next_offset = self.skip_empty_space(cur_offset)
+                    if next_offset == cur_offset:
                         break
-                    # due to page alignments there might
-                    # be extra NULL bytes
-                    if (cur_offset + 4) % 4096 != 0:
-                        ofs = self.infile.tell()
-                        bytes_to_read = 4096 - ((cur_offset + 4)%4096)
-                        buf = self.infile.read(bytes_to_read)
-                        if buf != b'\x00' * bytes_to_read:
-                            self.infile.seek(ofs)
-                            break
+                    self.infile.seek(next_offset)
+                    continue
                 else:
-                    break
-                prev_is_padding = True
-                continue
+                    node_magic_type = 'normal'
+
+                # skip dirty nodes. Some manual parsing is needed here. As from
+                # the magic it isn't clear which endianness is used it needs to
+                # be taken from the context
+                if node_magic_type == 'dirty':
+                    # read the node type and the node length in one go
+                    # and only use the length.
+                    buf = self.infile.read(6)
+                    if len(buf) != 6:
+                        break
 
-            prev_is_padding = False
+                    len_inode = int.from_bytes(buf[2:], byteorder=self.byteorder)
+                    if cur_offset + len_inode > self.infile.size:
+                        break
 
-            # process directory entries
-            if jffs2_inode.header.inode_type == jffs2.Jffs2.InodeType.dirent:
-                inode_number = jffs2_inode.data.inode_number
+                    # skip the dirty data
+                    # nodes are 4 byte aligned, so also skip any padding
+                    self.infile.seek((cur_offset + len_inode + 3) & ~3)
+                    continue
 
-                parent_inodes_seen.add(jffs2_inode.data.parent_inode)
+                # reset the file pointer and parse with Kaitai Struct
+                self.infile.seek(cur_offset)
 
-                # skip unlinked inodes
-                if inode_number == 0:
-                    # first go back to the old offset, then skip
-                    # the entire inode
-                    self.infile.seek(cur_offset + jffs2_inode.header.len_inode)
-                    unpackedsize = self.infile.tell()
-                    if unpackedsize % 4 != 0:
-                        paddingbytes = 4 - (unpackedsize % 4)
-                        self.infile.seek(paddingbytes, os.SEEK_CUR)
-                        unpackedsize = self.infile.tell()
+                jffs2_inode = jffs2.Jffs2.from_io(self.infile)
+
+                # check if the inode type is actually valid
+                # or perhaps contains padding.
+                if isinstance(jffs2_inode.header.inode_type, int):
+                    if jffs2_inode.header.inode_type == 0:
+                        if prev_is_padding:
+                            break
+                        # due to page alignments there might
+                        # be extra NULL bytes
+                        if (cur_offset + 4) % 4096 != 0:
+                            ofs = self.infile.tell()
+                            bytes_to_read = 4096 - ((cur_offset + 4)%4096)
+                            buf = self.infile.read(bytes_to_read)
+                            if buf != b'\x00' * bytes_to_read:
+                                self.infile.seek(ofs)
+                                break
+                    else:
+                        break
+                    prev_is_padding = True
                     continue
 
-                inode_name = jffs2_inode.data.name.decode()
+                prev_is_padding = False
 
-                # process any possible hard links
-                if inode_number in inode_to_filename:
-                    # the inode number is already known, meaning
-                    # that this should be a hard link
-                    target = pathlib.Path(inode_name)
-                    file_path = pathlib.Path(inode_to_filename[inode_number])
-                    meta_directory.unpack_hardlink(target, file_path)
+                # process directory entries
+                if jffs2_inode.header.inode_type == jffs2.Jffs2.InodeType.dirent:
+                    inode_number = jffs2_inode.data.inode_number
 
-                # now add the name to the inode to filename mapping
-                if jffs2_inode.data.parent_inode in inode_to_filename:
-                    inode_to_filename[inode_number] = inode_to_filename[jffs2_inode.data.parent_inode] / inode_name
-
-            elif jffs2_inode.header.inode_type == jffs2.Jffs2.InodeType.inode:
-                inode_number = jffs2_inode.data.inode_number
+                    parent_inodes_seen.add(jffs2_inode.data.parent_inode)
 
-                # first check if a file name for this inode is known
-                if inode_number not in inode_to_filename:
-                    break
+                    # skip unlinked inodes
+                    if inode_number == 0:
+                        # first go back to the old offset, then skip
+                        # the entire inode
+                        # nodes are 4 byte aligned, so also skip any padding
+                        self.infile.seek((cur_offset + jffs2_inode.header.len_inode + 3) & ~3)
+                        continue
 
-                # first check if a file name for this inode is known
-                if inode_number not in inode_to_filename:
-                    break
+                    inode_name = jffs2_inode.data.name.decode()
 
-                file_path = pathlib.Path(inode_to_filename[inode_number])
+                    # process any possible hard links
+                    if inode_number in inode_to_filename:
+                        # the inode number is already known, meaning
+                        # that this should be a hard link
+                        target = pathlib.Path(inode_name)
+                        file_path = pathlib.Path(inode_to_filename[inode_number])
+                        meta_directory.unpack_hardlink(target, file_path)
 
-                # skip unlinked inodes
-                if inode_number == 0:
-                    # first go back to the old offset, then skip
-                    # the entire inode
-                    self.infile.seek(cur_offset + inode_size)
-                    unpackedsize = self.infile.tell()
-                    if unpackedsize % 4 != 0:
-                        paddingbytes = 4 - (unpackedsize % 4)
-                        self.infile.seek(paddingbytes, os.SEEK_CUR)
-                        unpackedsize = self.infile.tell()
-                    continue
+                    # now add the name to the inode to filename mapping
+                    if jffs2_inode.data.parent_inode in inode_to_filename:
+                        inode_to_filename[inode_number] = inode_to_filename[jffs2_inode.data.parent_inode] / inode_name
 
-                filemode = jffs2_inode.data.file_mode
+                elif jffs2_inode.header.inode_type == jffs2.Jffs2.InodeType.inode:
+                    inode_number = jffs2_inode.data.inode_number
 
-                if filemode == jffs2.Jffs2.Modes.socket:
-                    # keep track of whatever is in the file and report
-                    pass
-                elif filemode == jffs2.Jffs2.Modes.directory:
-                    # create directories, but skip them otherwise
-                    meta_directory.unpack_directory(file_path)
-                    continue
-                elif filemode == jffs2.Jffs2.Modes.link:
-                    target = jffs2_inode.data.body.data.decode()
-                    meta_directory.unpack_symlink(file_path, target)
-                elif filemode == jffs2.Jffs2.Modes.regular:
-                    writeoffset = jffs2_inode.data.body.ofs_write
+                    # first check if a file name for this inode is known
+                    if inode_number not in inode_to_filename:
+                        break
 
-                    if writeoffset == 0:
-                        if inode_number in inode_to_write_offset:
-                            break
-                        if inode_number in unpacked_mds:
-                            break
+                    # first check if a file name for this inode is known
+                    if inode_number not in inode_to_filename:
+                        break
 
-                        # write a stub file
-                        # empty file
-                        with meta_directory.unpack_regular_file(file_path) as (unpacked_md, outfile):
-                            unpacked_mds[inode_number] = unpacked_md
+                    file_path = pathlib.Path(inode_to_filename[inode_number])
 
-                        current_inode = inode_number
-                    else:
-                        if writeoffset != inode_to_write_offset[inode_number]:
+                    # skip unlinked inodes
+                    if inode_number == 0:
+                        # first go back to the old offset, then skip
+                        # the entire inode
+                        # nodes are 4 byte aligned, so also skip any padding
+                        self.infile.seek((cur_offset + jffs2_inode.header.len_inode + 3) & ~3)
+                        continue
+
+                    filemode = jffs2_inode.data.file_mode
+
+                    if filemode == jffs2.Jffs2.Modes.socket:
+                        # keep track of whatever is in the file and report
+                        pass
+                    elif filemode == jffs2.Jffs2.Modes.directory:
+                        # create directories, but skip them otherwise
+                        meta_directory.unpack_directory(file_path)
+                        continue
+                    elif filemode == jffs2.Jffs2.Modes.link:
+                        target = jffs2_inode.data.body.data.decode()
+                        meta_directory.unpack_symlink(file_path, target)
+                    elif filemode == jffs2.Jffs2.Modes.regular:
+                        writeoffset = jffs2_inode.data.body.ofs_write
+
+                        if jffs2_inode.data.body.compression not in DECOMPRESSABLE_COMPRESSION:
                             break
-                        if inode_number not in unpacked_mds:
+
+                        # parse() does not decompress data with a correct
+                        # data CRC, so the data could still be invalid. In
+                        # that case the file system ends here, like parse()
+                        # does for other invalid data.
+                        try:
+                            uncompressed_data = decompress_node(jffs2_inode.data.body)
+                        except DECOMPRESSION_ERRORS:
                             break
 
-                    decompressed_size = jffs2_inode.data.body.len_decompressed
+                        if writeoffset == 0:
+                            if inode_number in inode_to_write_offset:
+                                break
+                            if inode_number in unpacked_mds:
+                                break
+
+                            # write a stub file
+                            # empty file
+                            with meta_directory.unpack_regular_file(file_path) as (unpacked_md, _):
+                                unpacked_mds[inode_number] = unpacked_md
 
-                    unpacked_md = unpacked_mds[inode_number]
-                    with open(unpacked_md.abs_file_path, 'ab') as outfile:
-                        # Check the compression that's used as it could be that
-                        # for a file compressed and uncompressed nodes are mixed
-                        # in case the node cannot be compressed efficiently
-                        # and the compressed data would be larger than the
-                        # original data.
-                        if jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.no_compression:
-                            # the data is not compressed, so can be written
-                            # to the output file immediately
-                            outfile.write(jffs2_inode.data.body.data)
-                        elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.zlib:
-                            # the data is zlib compressed, so first decompress
-                            # before writing
-                            uncompressed_data = zlib.decompress(jffs2_inode.data.body.data)
-                            if len(uncompressed_data) > decompressed_size:
-                                outfile.write(uncompressed_data[:decompressed_size])
-                            else:
-                                outfile.write(uncompressed_data)
-                        elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.lzma:
-                            # The data is LZMA compressed, so create a
-                            # LZMA decompressor with custom filter, as the data
-                            # is stored without LZMA headers.
-                            jffs_filters = [{'id': lzma.FILTER_LZMA1,
-                                             'dict_size': LZMA_DICT_SIZE,
-                                             'lc': LZMA_LC, 'lp': LZMA_LP,
-                                             'pb': LZMA_PB}]
-
-                            decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=jffs_filters)
-                            uncompressed_data = decompressor.decompress(jffs2_inode.data.body.data)
-                            if len(uncompressed_data) > decompressed_size:
-                                outfile.write(uncompressed_data[:decompressed_size])
-                            else:
-                                outfile.write(uncompressed_data)
-                        elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.rtime:
-                            # From: https://github.com/sviehb/jefferson/blob/master/src/jefferson/rtime.py
-                            # First initialize the positions, set to 0
-                            positions = [0] * 256
-
-                            # create a bytearray, set everything to 0
-                            data_out = bytearray([0] * decompressed_size)
-
-                            # create counters
-                            outpos = 0
-                            pos = 0
-
-                            # process all the bytes
-                            while outpos < decompressed_size:
-                                value = jffs2_inode.data.body.data[pos]
-                                pos += 1
-                                data_out[outpos] = value
-                                outpos += 1
-                                repeat = jffs2_inode.data.body.data[pos]
-                                pos += 1
-
-                                backoffs = positions[value]
-                                positions[value] = outpos
-                                if repeat:
-                                    if backoffs + repeat >= outpos:
-                                        while repeat:
-                                            data_out[outpos] = data_out[backoffs]
-                                            outpos += 1
-                                            backoffs += 1
-                                            repeat -= 1
-                                    else:
-                                        data_out[outpos : outpos + repeat] = data_out[
-                                            backoffs : backoffs + repeat
-                                        ]
-                                        outpos += repeat
-                            outfile.write(data_out)
-                        elif jffs2_inode.data.body.compression == jffs2.Jffs2.Compression.lzo:
-                            outfile.write(lzo.decompress(jffs2_inode.data.body.data, False, decompressed_size))
+                            current_inode = inode_number
                         else:
-                            break
+                            if writeoffset != inode_to_write_offset[inode_number]:
+                                break
+                            if inode_number not in unpacked_mds:
+                                break
+
+                        decompressed_size = jffs2_inode.data.body.len_decompressed
+
+                        # The data of a file is spread over many (small) nodes,
+                        # which are typically stored consecutively, so keep the
+                        # output file open until a node for another inode is
+                        # found, instead of opening it for every node. A large
+                        # buffer is used to combine the writes of several nodes.
+                        if inode_number != outfile_inode:
+                            if outfile is not None:
+                                outfile.close()
+                            outfile = open(unpacked_mds[inode_number].abs_file_path, 'ab', buffering=1024*1024)
+                            outfile_inode = inode_number
+
+                        outfile.write(uncompressed_data)
 
-                        # flush any remaining data
                         inode_to_write_offset[inode_number] = writeoffset + decompressed_size
-                        outfile.flush()
-
-                        # unsure what to do here now.
 
-            unpackedsize = self.infile.tell()
-            if unpackedsize % 4 != 0:
-                paddingbytes = 4 - (unpackedsize % 4)
-                self.infile.seek(paddingbytes, os.SEEK_CUR)
-                unpackedsize = self.infile.tell()
+                # nodes are 4 byte aligned, so skip any padding
+                next_offset = self.infile.tell()
+                if next_offset % 4 != 0:
+                    self.infile.seek((next_offset + 3) & ~3)
+        finally:
+            if outfile is not None:
+                outfile.close()
 
         for unpacked_md in unpacked_mds.values():
             yield unpacked_md
@@ -26,4 +26,66 @@ def test_load_mbr_partition_table(scan_environment):
             for _ in p.unpack(opened_md): pass
 
 
+def create_gpt_image():
+    '''Create a GPT image with 512 byte sectors and room for
+    four partition entries, of which only the first and third
+    are used.'''
+    sector_size = 0x200
+    header = b'EFI PART'
+    header += (0x10000).to_bytes(4, 'little')   # revision
+    header += (92).to_bytes(4, 'little')        # header size
+    header += b'\x00' * 8                       # header CRC, reserved
+    header += (1).to_bytes(8, 'little')         # current LBA
+    header += (8).to_bytes(8, 'little')         # backup LBA
+    header += (4).to_bytes(8, 'little')         # first usable LBA
+    header += (7).to_bytes(8, 'little')         # last usable LBA
+    header += b'\x11' * 16                      # disk GUID
+    header += (2).to_bytes(8, 'little')         # entries start
+    header += (4).to_bytes(4, 'little')         # entries count
+    header += (128).to_bytes(4, 'little')       # entries size
+    header += b'\x00' * 4                       # entries CRC
+    header = header.ljust(sector_size, b'\x00')
 
+    def entry(guid, first_lba, last_lba, name):
+        return (b'\x22' * 16 + guid + first_lba.to_bytes(8, 'little')
+                + last_lba.to_bytes(8, 'little') + b'\x00' * 8
+                + name.encode('utf-16-le').ljust(0x48, b'\x00'))
+
+    unused_entry = b'\x00' * 128
+    entries = entry(b'\x33' * 16, 4, 5, 'first') + unused_entry
+    entries += entry(b'\x44' * 16, 6, 7, 'second') + unused_entry
+    entries = entries.ljust(2 * sector_size, b'\x00')
+
+    return (b'\x00' * sector_size + header + entries + b'A' * 2 * sector_size
+            + b'B' * 2 * sector_size + header)
+
+
+def test_unused_entries_skipped(scan_environment):
+    fn = pathlib.Path('gpt-unused-entries.img')
+    testfile = create_test_file(scan_environment, fn, create_gpt_image())
+    md = create_meta_directory_for_path(scan_environment, testfile, True)
+    with md.open() as opened_md:
+        p = GptPartitionTableUnpackParser(opened_md, 0)
+        p.parse_from_offset()
+        p.write_info(opened_md)
+        for _ in p.unpack(opened_md): pass
+    with reopen_md(md).open(open_file=False) as unpacked_md:
+        assert len(unpacked_md.unpacked_files) == 2
+        assert [e['name'] for e in unpacked_md.info['metadata']['partitions']] == ['first', 'second']
+
+
+def test_partitions_at_offset(scan_environment):
+    fn = pathlib.Path('gpt-at-offset.img')
+    testfile = create_test_file(scan_environment, fn, b'\xaa' * 1024 + create_gpt_image())
+    md = create_meta_directory_for_path(scan_environment, testfile, True)
+    with md.open() as opened_md:
+        p = GptPartitionTableUnpackParser(opened_md, 1024)
+        p.parse_from_offset()
+        p.write_info(opened_md)
+        for _ in p.unpack(opened_md): pass
+    with reopen_md(md).open(open_file=False) as unpacked_md:
+        partitions = []
+        for unpacked_path in sorted(unpacked_md.unpacked_files):
+            with open(scan_environment.unpackdirectory / unpacked_path, 'rb') as f:
+                partitions.append(f.read())
+        assert partitions == [b'A' * 1024, b'B' * 1024]
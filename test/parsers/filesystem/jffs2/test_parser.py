@@ -0,0 +1,98 @@
+import sys, os
+import zlib
+from util import *
+from mock_metadirectory import *
+
+from bang.parsers.filesystem.jffs2.UnpackParser import Jffs2UnpackParser
+
+def jffs2_crc(data):
+    return (zlib.crc32(data, -1) ^ -1) & 0xffffffff
+
+def jffs2_node(node_type, body):
+    '''Create a little endian JFFS2 node, padded to 4 bytes'''
+    header = b'\x85\x19' + node_type.to_bytes(2, 'little') + (12 + len(body)).to_bytes(4, 'little')
+    node = header + jffs2_crc(header).to_bytes(4, 'little') + body
+    return node + b'\x00' * (-len(node) % 4)
+
+def jffs2_dirent(parent_inode, inode_number, name):
+    name = name.encode()
+    body = parent_inode.to_bytes(4, 'little') + (1).to_bytes(4, 'little')
+    body += inode_number.to_bytes(4, 'little') + b'\x00' * 4
+    body += bytes([len(name), 8]) + b'\x00' * 6
+    body += jffs2_crc(name).to_bytes(4, 'little') + name
+    return jffs2_node(0xe001, body)
+
+def jffs2_inode(inode_number, version, write_offset, data, compression, decompressed_size):
+    body = inode_number.to_bytes(4, 'little') + version.to_bytes(4, 'little')
+    body += (0o100644).to_bytes(4, 'little') + b'\x00' * 20
+    body += write_offset.to_bytes(4, 'little') + len(data).to_bytes(4, 'little')
+    body += decompressed_size.to_bytes(4, 'little') + bytes([compression, 0]) + b'\x00' * 2
+    body += jffs2_crc(data).to_bytes(4, 'little') + b'\x00' * 4 + data
+    return jffs2_node(0xe002, body)
+
+
+# the data CRC of the node is valid, but the data is not valid zlib
+# data, so the file system ends at that node when unpacking
+def test_crc_valid_corrupt_data(scan_environment):
+    fn = pathlib.Path('test-crc-valid-corrupt-data.jffs2')
+    content = jffs2_dirent(1, 2, 'a') + jffs2_inode(2, 1, 0, zlib.compress(b'A' * 100), 6, 100)
+    content += jffs2_dirent(1, 3, 'corrupt') + jffs2_inode(3, 1, 0, b'\x00corrupt', 6, 100)
+    testfile = create_test_file(scan_environment, fn, content)
+    md = create_meta_directory_for_path(scan_environment, testfile, True)
+    with md.open() as opened_md:
+        p = Jffs2UnpackParser(opened_md, 0)
+        p.parse_from_offset()
+        p.write_info(opened_md)
+        for _ in p.unpack(opened_md): pass
+    with reopen_md(md).open(open_file=False) as unpacked_md:
+        assert len(unpacked_md.unpacked_files) == 1
+        unpacked_path_abs = scan_environment.unpackdirectory / unpacked_md.unpacked_path(pathlib.Path('a'))
+        with open(unpacked_path_abs, 'rb') as f:
+            assert f.read() == b'A' * 100
+
+
+# the data CRC of the node is not valid, but the data can be decompressed
+def test_crc_invalid_valid_data(scan_environment):
+    fn = pathlib.Path('test-crc-invalid-valid-data.jffs2')
+    inode = bytearray(jffs2_inode(2, 1, 0, zlib.compress(b'A' * 100), 6, 100))
+    # overwrite the data CRC
+    inode[60:64] = b'\x12\x34\x56\x78'
+    content = jffs2_dirent(1, 2, 'a') + bytes(inode)
+    testfile = create_test_file(scan_environment, fn, content)
+    md = create_meta_directory_for_path(scan_environment, testfile, True)
+    with md.open() as opened_md:
+        p = Jffs2UnpackParser(opened_md, 0)
+        p.parse_from_offset()
+        assert p.unpacked_size == len(content)
+        p.write_info(opened_md)
+        for _ in p.unpack(opened_md): pass
+    with reopen_md(md).open(open_file=False) as unpacked_md:
+        unpacked_path_abs = scan_environment.unpackdirectory / unpacked_md.unpacked_path(pathlib.Path('a'))
+        with open(unpacked_path_abs, 'rb') as f:
+            assert f.read() == b'A' * 100
+
+
+# the data of a file is spread over several nodes, which are
+# interleaved with the nodes of another file
+def test_interleaved_files(scan_environment):
+    fn = pathlib.Path('test-interleaved-files.jffs2')
+    content = jffs2_dirent(1, 2, 'a') + jffs2_dirent(1, 3, 'b')
+    content += jffs2_inode(2, 1, 0, zlib.compress(b'A' * 100), 6, 100)
+    content += jffs2_inode(2, 2, 100, b'x' * 7, 0, 7)
+    content += jffs2_inode(3, 1, 0, zlib.compress(b'B' * 50), 6, 50)
+    content += jffs2_inode(2, 3, 107, zlib.compress(b'C' * 10), 6, 10)
+    testfile = create_test_file(scan_environment, fn, content)
+    md = create_meta_directory_for_path(scan_environment, testfile, True)
+    with md.open() as opened_md:
+        p = Jffs2UnpackParser(opened_md, 0)
+        p.parse_from_offset()
+        p.write_info(opened_md)
+        for _ in p.unpack(opened_md): pass
+    with reopen_md(md).open(open_file=False) as unpacked_md:
+        assert len(unpacked_md.unpacked_files) == 2
+        unpacked_path_abs = scan_environment.unpackdirectory / unpacked_md.unpacked_path(pathlib.Path('a'))
+        with open(unpacked_path_abs, 'rb') as f:
+            assert f.read() == b'A' * 100 + b'x' * 7 + b'C' * 10
+        unpacked_path_abs = scan_environment.unpackdirectory / unpacked_md.unpacked_path(pathlib.Path('b'))
+        with open(unpacked_path_abs, 'rb') as f:
+            assert f.read() == b'B' * 50